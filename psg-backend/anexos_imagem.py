@@ -0,0 +1,145 @@
+"""
+Ingestão das imagens anexadas aos PSGs.
+
+- os uploads são recebidos direto em memória (BufferAnexo), que para de aceitar bytes
+  assim que um arquivo passa do limite por arquivo (o limite da requisição inteira é o
+  MAX_CONTENT_LENGTH do Flask);
+- o formato é detectado pelos primeiros bytes, não pela extensão do nome;
+- imagens idênticas (mesmo sha256) aparecem em todos os lugares em que foram anexadas,
+  mas compartilham os mesmos bytes: são otimizadas uma vez só e o python-docx guarda uma
+  única cópia delas no pacote .docx;
+- no processo de renderização, otimizar() reduz a imagem para a largura de impressão
+  (LARGURA_IMPRESSAO_POLEGADAS x DPI_MAXIMO) e recomprime. Sem Pillow instalado,
+  os bytes originais são usados.
+"""
+import hashlib
+import io
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow é opcional
+    Image = None
+
+TAMANHO_MAXIMO_ANEXO = 15 * 1024 * 1024
+TAMANHO_MAXIMO_REQUISICAO = 60 * 1024 * 1024
+LARGURA_IMPRESSAO_POLEGADAS = 5
+DPI_MAXIMO = 200
+QUALIDADE_JPEG = 85
+TAMANHO_BLOCO_LEITURA = 256 * 1024
+
+ASSINATURAS = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff'),
+)
+
+
+class AnexoGrandeDemais(Exception):
+    """Um anexo passou de TAMANHO_MAXIMO_ANEXO."""
+
+
+def detectar_tipo(dados):
+    """Formato da imagem pelos bytes iniciais ('png', 'jpeg', ...) ou None se não reconhecido."""
+    for assinatura, tipo in ASSINATURAS:
+        if dados.startswith(assinatura):
+            return tipo
+    return None
+
+
+class BufferAnexo(io.BytesIO):
+    """
+    Destino de um arquivo do multipart: levanta AnexoGrandeDemais na escrita que passaria
+    de TAMANHO_MAXIMO_ANEXO, então o restante do arquivo nem chega a ser guardado.
+    """
+
+    def __init__(self, nome_arquivo=None):
+        super().__init__()
+        self.nome_arquivo = nome_arquivo
+
+    def write(self, dados):
+        if self.tell() + len(dados) > TAMANHO_MAXIMO_ANEXO:
+            raise AnexoGrandeDemais(
+                f"O anexo '{self.nome_arquivo}' passa de {TAMANHO_MAXIMO_ANEXO // (1024 * 1024)} MB."
+            )
+        return super().write(dados)
+
+
+def ler_upload(file_storage):
+    """
+    Bytes do upload. Vindo de um BufferAnexo, o limite já foi aplicado no recebimento e os
+    bytes são devolvidos sem cópia extra; outros streams são lidos em blocos, parando
+    assim que passar do limite por arquivo.
+    """
+    if isinstance(file_storage.stream, BufferAnexo):
+        return file_storage.stream.getvalue()
+    buffer = io.BytesIO()
+    while True:
+        bloco = file_storage.stream.read(TAMANHO_BLOCO_LEITURA)
+        if not bloco:
+            break
+        buffer.write(bloco)
+        if buffer.tell() > TAMANHO_MAXIMO_ANEXO:
+            raise AnexoGrandeDemais(
+                f"O anexo '{file_storage.filename}' passa de {TAMANHO_MAXIMO_ANEXO // (1024 * 1024)} MB."
+            )
+    return buffer.getvalue()
+
+
+def blocos_anexos(uploads):
+    """
+    Converte os uploads em blocos da especificação do renderizador: ('imagem', nome, bytes)
+    para cada imagem e parágrafos para as não suportadas. Repetições da mesma imagem
+    reaproveitam o objeto bytes da primeira (enviado uma única vez ao renderizador).
+    """
+    blocos = []
+    por_hash = {}
+    for file_storage in uploads:
+        nome = file_storage.filename
+        dados = ler_upload(file_storage)
+
+        if detectar_tipo(dados) is None:
+            blocos.append(('paragrafo', f"Arquivo: {nome}"))
+            blocos.append(('paragrafo', f"Erro ao inserir imagem {nome}: formato de imagem não reconhecido."))
+            continue
+
+        dados = por_hash.setdefault(hashlib.sha256(dados).hexdigest(), dados)
+        blocos.append(('imagem', nome, dados))
+    return blocos
+
+
+def otimizar(dados):
+    """
+    Reduz a imagem para no máximo LARGURA_IMPRESSAO_POLEGADAS x DPI_MAXIMO pixels de largura
+    e recomprime (JPEG para fotos, PNG para o resto). Devolve os bytes originais se não
+    houver ganho, se o Pillow não estiver instalado ou se a imagem não puder ser lida.
+    """
+    if Image is None:
+        return dados
+    try:
+        with Image.open(io.BytesIO(dados)) as imagem:
+            formato_original = imagem.format
+            imagem = ImageOps.exif_transpose(imagem)
+            largura_maxima = LARGURA_IMPRESSAO_POLEGADAS * DPI_MAXIMO
+            if imagem.width > largura_maxima:
+                altura = max(1, round(imagem.height * largura_maxima / imagem.width))
+                imagem = imagem.resize((largura_maxima, altura), Image.LANCZOS)
+
+            saida = io.BytesIO()
+            if formato_original == 'JPEG':
+                imagem.convert('RGB').save(saida, 'JPEG', quality=QUALIDADE_JPEG, optimize=True,
+                                           dpi=(DPI_MAXIMO, DPI_MAXIMO))
+            else:
+                # GIF/BMP/TIFF viram PNG; prints de tela continuam nítidos
+                if imagem.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+                    imagem = imagem.convert('RGBA')
+                imagem.save(saida, 'PNG', optimize=True, dpi=(DPI_MAXIMO, DPI_MAXIMO))
+    except Exception as e:
+        print(f"Aviso: imagem não otimizada ({e}); usando o arquivo original.")
+        return dados
+
+    otimizada = saida.getvalue()
+    return otimizada if len(otimizada) < len(dados) else dados
@@ -1,133 +1,270 @@
 import sqlite3
 import os
+import threading
 import io
 import json
-from flask import Flask, jsonify, request, send_file
+import hashlib
+import html
+import re
+import zipfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import quote
+from flask import Flask, Request, jsonify, request, send_file, make_response, Response, stream_with_context
 from flask_cors import CORS
-from docx import Document
-from docx.shared import RGBColor, Pt, Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_PARAGRAPH_ALIGNMENT
-from docx.oxml.ns import qn
-from docx.oxml import OxmlElement
+from werkzeug.security import safe_join
 from datetime import datetime
 import tempfile
 import smtplib
 from email.mime.text import MIMEText
-import requests
 from pathlib import Path
+from graph_client import GraphClient
+from cria_banco import criar_banco_de_dados
+import banco
+import outbox
+import renderizador
+import anexos_imagem
+import cache_render
+import modelo_documento
+import indice_diretorios
+
+class RequisicaoAnexosEmMemoria(Request):
+    """
+    Uploads ficam em memória (sem arquivos temporários). A requisição é limitada por
+    MAX_CONTENT_LENGTH e cada arquivo por anexos_imagem.TAMANHO_MAXIMO_ANEXO, aplicado
+    durante a leitura do multipart (AnexoGrandeDemais ao acessar request.form/files).
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return anexos_imagem.BufferAnexo(filename)
 
 # Configuração da aplicação Flask
 app = Flask(__name__)
-CORS(app)
+app.request_class = RequisicaoAnexosEmMemoria
+# Requisições maiores são recusadas (413) antes de qualquer byte do corpo ser lido
+app.config['MAX_CONTENT_LENGTH'] = anexos_imagem.TAMANHO_MAXIMO_REQUISICAO
+# ETag e o cursor da paginação precisam ser legíveis pelo front-end
+CORS(app, expose_headers=['ETag', 'X-Next-After-Id'])
+
+# Cliente do Microsoft Graph (token, sessão e drive ID em cache)
+_graph_client = None
+
+# Envio dos arquivos de /download:
+#   'flask'      -> o próprio Flask envia (com ETag, 304 e Range)
+#   'x-sendfile' -> cabeçalho X-Sendfile (Apache mod_xsendfile, lighttpd)
+#   'x-accel'    -> cabeçalho X-Accel-Redirect (nginx), com BASE_PATH exposto em PREFIXO_X_ACCEL
+#                   por uma location 'internal' (ex.: location /protegido/documentos/ { internal; alias ...; })
+MODO_ENVIO_ARQUIVOS = 'flask'
+PREFIXO_X_ACCEL = '/protegido/documentos/'
+app.use_x_sendfile = MODO_ENVIO_ARQUIVOS == 'x-sendfile'
+
+# Modo debug (com reloader) do servidor de desenvolvimento, usado em python app.py
+MODO_DEBUG = True
 
 # --- Funções de Banco de Dados ---
 def get_db_connection():
-    """Cria e retorna a conexão com o banco de dados."""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """
+    Retorna a conexão da thread atual com o banco de dados (WAL, busy_timeout).
+    A conexão é reaproveitada durante a requisição e fechada no teardown.
+    """
+    return banco.get_connection(DATABASE)
 
-def obter_proximo_numero(pasta_nome):
-    """Retorna o próximo número disponível para o documento na pasta."""
-    full_path = os.path.join(BASE_PATH, pasta_nome)
+@app.teardown_appcontext
+def fechar_conexao_banco(exception):
+    banco.fechar_conexoes()
 
-    if not os.path.exists(full_path):
-        return "01"
+def reservar_numero_documento(pasta_id, tema_sigla, quantidade=1):
+    """
+    Reserva 'quantidade' números seguidos na sequência (pasta, tema) e retorna o primeiro.
+    O incremento acontece dentro de BEGIN IMMEDIATE, então requisições e workers
+    simultâneos nunca recebem o mesmo número.
+    """
+    return reservar_numeros_lote({(pasta_id, tema_sigla): quantidade})[(pasta_id, tema_sigla)]
 
+def reservar_numeros_lote(quantidades):
+    """
+    Reserva, em uma única transação, números para várias sequências.
+    quantidades: dict (pasta_id, tema_sigla) -> quantidade. Retorna dict com o primeiro número de cada uma.
+    """
+    conferir_sequencias_arquivos()
     conn = get_db_connection()
-    sigla_pasta = conn.execute("SELECT sigla FROM pastas WHERE nome = ?", (pasta_nome,)).fetchone()['sigla']
-    conn.close()
+    primeiros = {}
+    with banco.transacao(conn, imediata=True):
+        for (pasta_id, tema_sigla), quantidade in quantidades.items():
+            conn.execute("""
+                INSERT OR IGNORE INTO sequencias (pasta_id, tema_sigla, ultimo_numero) VALUES (?, ?, 0)
+            """, (pasta_id, tema_sigla))
+            conn.execute("""
+                UPDATE sequencias SET ultimo_numero = ultimo_numero + ?
+                WHERE pasta_id = ? AND tema_sigla = ?
+            """, (quantidade, pasta_id, tema_sigla))
+            ultimo = conn.execute("""
+                SELECT ultimo_numero FROM sequencias WHERE pasta_id = ? AND tema_sigla = ?
+            """, (pasta_id, tema_sigla)).fetchone()['ultimo_numero']
+            primeiros[(pasta_id, tema_sigla)] = ultimo - quantidade + 1
+    return primeiros
 
-    arquivos_existentes = [f for f in os.listdir(full_path) if f.startswith(f"PSG-{sigla_pasta}-")]
-    numeros = []
-    
-    for arquivo in arquivos_existentes:
-        try:
-            partes = arquivo.split('-')
-            if len(partes) >= 3:
-                numero_str = partes[-1].split('.')[0]
-                if numero_str.isdigit():
-                    numeros.append(int(numero_str))
-        except:
-            continue
-    
-    proximo_numero = max(numeros) + 1 if numeros else 1
-    return f"{proximo_numero:02d}"
+# As sequências são conferidas com os arquivos de BASE_PATH uma vez por processo, antes da
+# primeira reserva: vale para python app.py, servidores WSGI e worker_outbox.py
+_sequencias_conferidas = False
+_lock_sequencias = threading.Lock()
+
+def conferir_sequencias_arquivos():
+    """
+    Leva cada sequência (pasta, tema) pelo menos até o maior número dos arquivos
+    PSG-{sigla}-{tema}-{nn}.docx já existentes em BASE_PATH (documentos antigos eram
+    numerados pelo id global). Os números dos registros do banco já entram pela migração.
+    Só aumenta sequências, então pode rodar em vários processos ao mesmo tempo.
+    """
+    global _sequencias_conferidas
+    with _lock_sequencias:
+        if _sequencias_conferidas:
+            return
+        conn = get_db_connection()
+        maximos = {}
+        for pasta in conn.execute("SELECT id, nome, sigla FROM pastas").fetchall():
+            full_path = os.path.join(BASE_PATH, pasta['nome'])
+            if not os.path.isdir(full_path):
+                continue
+            prefixo = f"PSG-{pasta['sigla']}-"
+            for arquivo in os.listdir(full_path):
+                if not (arquivo.startswith(prefixo) and arquivo.endswith('.docx')):
+                    continue
+                partes = arquivo[len(prefixo):-len('.docx')].rsplit('-', 1)
+                if len(partes) == 2 and partes[1].isdigit():
+                    chave = (pasta['id'], partes[0])
+                    maximos[chave] = max(maximos.get(chave, 0), int(partes[1]))
+
+        with banco.transacao(conn, imediata=True):
+            conn.executemany("""
+                INSERT INTO sequencias (pasta_id, tema_sigla, ultimo_numero) VALUES (?, ?, ?)
+                ON CONFLICT (pasta_id, tema_sigla) DO UPDATE
+                SET ultimo_numero = MAX(ultimo_numero, excluded.ultimo_numero)
+            """, [(pasta_id, tema, maximo) for (pasta_id, tema), maximo in maximos.items()])
+        _sequencias_conferidas = True
 
 # --- Funções de Geração de Documento ---
-def criar_cabecalho(doc, titulo_pasta, sigla_pasta, tema_sigla, numero_documento):
-    """Cria e configura o cabeçalho do documento."""
-    section = doc.sections[0]
-    section.top_margin = Inches(0.5)
-    section.bottom_margin = Inches(0.5)
-    section.left_margin = Inches(0.5)
-    section.right_margin = Inches(0.5)
-
-    header = section.header
-    for paragraph in header.paragraphs:
-        paragraph.clear()
-    
-    tabela = header.add_table(rows=1, cols=3, width=Inches(7.5))
-    colunas = tabela.columns
-    colunas[0].width = Inches(0.2)
-    colunas[1].width = Inches(0.2)
-    colunas[2].width = Inches(0.2)
-
-    tbl = tabela._tbl
-    tblPr = tbl.tblPr
-    tblCellMar = OxmlElement('w:tblCellMar')
-    for tag in ['top', 'left', 'bottom', 'right']:
-        elem = OxmlElement(f'w:{tag}')
-        elem.set(qn('w:w'), '0')
-        elem.set(qn('w:type'), 'dxa')
-        tblCellMar.append(elem)
-    tblPr.append(tblCellMar)
-
-    linha = tabela.rows[0].cells
-    
+def nova_especificacao(titulo_pasta, sigla_pasta, tema_sigla, numero_documento):
+    """Especificação (dados simples) de um documento novo, renderizada pelo renderizador."""
+    return {
+        'cabecalho': {
+            'titulo_pasta': titulo_pasta,
+            'sigla_pasta': sigla_pasta,
+            'tema_sigla': tema_sigla,
+            'numero_documento': numero_documento,
+            'data_aprovacao': datetime.now().strftime("%d/%m/%Y"),
+            'imagem_esquerda': IMAGEM_ESQUERDA,
+            'imagem_direita': IMAGEM_DIREITA,
+        },
+        'blocos': [],
+    }
+
+def _campo_json(data, chave, padrao):
+    """Campos JSON chegam como texto no formulário e já decodificados no lote."""
+    valor = data.get(chave)
+    if valor is None or valor == '':
+        return padrao
+    return json.loads(valor) if isinstance(valor, str) else valor
+
+def ler_campos_documento(data):
+    """Extrai os campos de um documento do formulário de /gerar_documento (ou de um item do lote)."""
+    return {
+        'titulo': data.get('titulo', ''),
+        'tema': data.get('tema', ''),
+        'folder': _campo_json(data, 'folder', {}),
+        'revisoes': _campo_json(data, 'revisoes', []),
+        'email': data.get('email', ''),
+        'objetivo': data.get('objetivo', ''),
+        'responsabilidades': data.get('responsabilidades', ''),
+        'conceitosSiglas': data.get('conceitosSiglas', ''),
+        'diretrizes': data.get('diretrizes', ''),
+        'documentosComplementares': data.get('documentosComplementares', ''),
+        'referencias': data.get('referencias', ''),
+    }
+
+def renderizar_documento(campos, numero_documento, anexos=None):
+    """Monta a especificação do documento a partir dos campos, renderiza no pool e retorna os bytes .docx."""
+    folder = campos['folder']
+    spec = nova_especificacao(folder.get('nome', ''), folder.get('sigla', 'XXX'), campos['tema'], numero_documento)
+    blocos = spec['blocos']
+
+    blocos.append(('secao', "1. OBJETIVO", campos['objetivo']))
+    blocos.append(('secao', "2. RESPONSABILIDADES", campos['responsabilidades']))
+    blocos.append(('secao', "3. CONCEITOS E SIGLAS", campos['conceitosSiglas']))
+    blocos.append(('secao', "4. DIRETRIZES/PROCEDIMENTOS", campos['diretrizes']))
+
+    blocos.append(('titulo', "5. ANEXOS"))
+    if anexos:
+        blocos.extend(anexos_imagem.blocos_anexos(anexos))
+    else:
+        blocos.append(('paragrafo', "Nenhum anexo de imagem adicionado."))
+
+    blocos.append(('secao', "6. DOCUMENTOS COMPLEMENTARES", campos['documentosComplementares']))
+    blocos.append(('secao', "7. REFERÊNCIAS", campos['referencias']))
+
+    blocos.append(('titulo', "8. CONTROLE DE REVISÃO"))
+    if campos['revisoes']:
+        blocos.append(('tabela_revisoes', numero_documento, campos['revisoes']))
+    else:
+        blocos.append(('paragrafo', "Nenhuma revisão registrada."))
+
+    return renderizador.renderizar(spec)
+
+SQL_INSERIR_DOCUMENTO = """
+    INSERT INTO documentos (pasta_id, titulo, objetivo, responsaveis, conceitos_siglas, diretrizes, documentos_complementares, referencias, revisoes_json, anexos_json, data_criacao, tema_sigla, numero, atualizado_em)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_INSERIR_STATUS = """
+    INSERT INTO status (pasta_id, pasta_name, status, email)
+    VALUES (?, ?, ?, ?)
+"""
+
+def valores_documento(campos, numero, anexos_nomes):
+    """Parâmetros de SQL_INSERIR_DOCUMENTO e SQL_INSERIR_STATUS para um documento novo."""
+    folder = campos['folder']
+    agora = datetime.now()
+    documento = (
+        folder.get('id'), campos['titulo'], campos['objetivo'], campos['responsabilidades'], campos['conceitosSiglas'],
+        campos['diretrizes'], campos['documentosComplementares'], campos['referencias'],
+        json.dumps(campos['revisoes']), json.dumps(anexos_nomes), agora.strftime("%Y-%m-%d"), campos['tema'], numero,
+        agora.isoformat()
+    )
+    status = (folder.get('id'), folder.get('nome', ''), "Pendente", campos['email'])
+    return documento, status
+
+def salvar_arquivo_atomico(caminho, conteudo):
+    """Grava os bytes em um arquivo temporário na mesma pasta e troca pelo destino com os.replace."""
+    pasta = os.path.dirname(caminho)
+    fd, caminho_tmp = tempfile.mkstemp(dir=pasta, prefix='.tmp-', suffix='.docx')
     try:
-        para_img_esq = linha[0].paragraphs[0]
-        run_img_esq = para_img_esq.add_run()
-        run_img_esq.add_picture(IMAGEM_ESQUERDA, width=Inches(0.8))
-        para_img_esq.alignment = WD_ALIGN_PARAGRAPH.LEFT
-        para_img_esq.paragraph_format.space_before = Pt(0)
-        para_img_esq.paragraph_format.space_after = Pt(0)
-    except Exception as e:
-        print(f"Erro ao adicionar imagem da esquerda: {e}")
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(conteudo)
+        os.replace(caminho_tmp, caminho)
+    except Exception:
+        if os.path.exists(caminho_tmp):
+            os.unlink(caminho_tmp)
+        raise
+    finally:
+        indice_diretorios.registrar_escrita(caminho)
 
-    conteudo_central = linha[1].paragraphs[0]
-    run_titulo = conteudo_central.add_run(f"PSG - {titulo_pasta} - {tema_sigla}\n")
-    run_titulo.bold = True
-    run_titulo.font.size = Pt(12)
-    
-    run_linha = conteudo_central.add_run("_" * 99 + "\n")
-    run_linha.font.size = Pt(10)
-    run_linha.font.bold = True
-    
-    codigo_psg = f"PSG.{sigla_pasta}.{tema_sigla}.{numero_documento}"
-    data_aprovacao = datetime.now().strftime("%d/%m/%Y")
-    texto_cabecalho = f"{codigo_psg}\t| Rev.\t{numero_documento}\t| Aprovação:\t{data_aprovacao}|"
-    run_info = conteudo_central.add_run(texto_cabecalho)
-    run_info.font.size = Pt(10)
-    run_info.bold = True
-    conteudo_central.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-    
+def ler_arquivo(caminho):
+    """Bytes do arquivo, ou None se ele não existir (ou não puder ser lido)."""
     try:
-        para_img_dir = linha[2].paragraphs[0]
-        run_img_dir = para_img_dir.add_run()
-        run_img_dir.add_picture(IMAGEM_DIREITA, width=Inches(0.6))
-        para_img_dir.alignment = WD_PARAGRAPH_ALIGNMENT.RIGHT
-        para_img_dir.paragraph_format.space_before = Pt(0)
-        para_img_dir.paragraph_format.space_after = Pt(0)
-    except Exception as e:
-        print(f"Erro ao adicionar imagem da direita: {e}")
-        
-    return doc
+        with open(caminho, 'rb') as arquivo:
+            return arquivo.read()
+    except OSError:
+        return None
 
-def adicionar_secao(doc, titulo_secao, conteudo):
-    """Adiciona uma seção com título e conteúdo ao documento."""
-    doc.add_heading(titulo_secao, level=2)
-    doc.add_paragraph(conteudo if conteudo.strip() else "Não informado.")
+def enviar_docx(conteudo, filename_docx, etag=None):
+    """Resposta de download de um .docx já em memória."""
+    resposta = send_file(
+        io.BytesIO(conteudo),
+        mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        as_attachment=True,
+        download_name=filename_docx
+    )
+    if etag:
+        resposta.set_etag(etag)
+    return resposta
 
 def send_notification_email(destinatario, assunto, corpo):
     """Envia um email de notificação."""
@@ -147,51 +284,38 @@ def send_notification_email(destinatario, assunto, corpo):
         print(f"❌ Erro ao enviar e-mail: {e}")
         return False
 
+def get_graph_client():
+    """Retorna o cliente Graph compartilhado da aplicação, criado na primeira chamada."""
+    global _graph_client
+    if _graph_client is None:
+        _graph_client = GraphClient(SHAREPOINT_TENANT_ID, SHAREPOINT_CLIENT_ID,
+                                    SHAREPOINT_CLIENT_SECRET, SHAREPOINT_SITE_URL)
+    return _graph_client
+
 def check_and_create_sharepoint_folder(folder_name):
     """
     Verifica se uma pasta existe no SharePoint e a cria se não existir.
     Retorna True se a pasta existir ou for criada, False caso contrário.
     """
     try:
-        token_url = f'https://login.microsoftonline.com/{SHAREPOINT_TENANT_ID}/oauth2/v2.0/token'
-        token_data = {
-            'grant_type': 'client_credentials',
-            'client_id': SHAREPOINT_CLIENT_ID,
-            'client_secret': SHAREPOINT_CLIENT_SECRET,
-            'scope': 'https://graph.microsoft.com/.default'
-        }
-        token_response = requests.post(token_url, data=token_data)
-        access_token = token_response.json().get('access_token')
-
-        headers = {'Authorization': f'Bearer {access_token}'}
-
-        domain = SHAREPOINT_SITE_URL.split('/')[2]
-        site_path = '/' + '/'.join(SHAREPOINT_SITE_URL.split('/')[3:])
-        site_id_url = f'https://graph.microsoft.com/v1.0/sites/{domain}:{site_path}'
-        site_id = requests.get(site_id_url, headers=headers).json().get('id')
-
-        drive_url = f'https://graph.microsoft.com/v1.0/sites/{site_id}/drives'
-        drive_response = requests.get(drive_url, headers=headers)
-        drives = drive_response.json().get('value', [])
-        drive_id = next((d['id'] for d in drives if d['name'] == 'Documentos'), None)
+        graph = get_graph_client()
+        drive_id = graph.get_drive_id()
         
         if not drive_id:
             print("❌ Drive 'Documentos' não encontrado.")
             return False
 
         caminho_completo = f'{SHAREPOINT_BASE_PATH}/{folder_name}'
-        check_url = f'https://graph.microsoft.com/v1.0/drives/{drive_id}/root:/{caminho_completo}'
-        check_response = requests.get(check_url, headers=headers)
+        check_url = graph.drive_path_url(drive_id, caminho_completo)
+        check_response = graph.get(check_url)
 
         if check_response.status_code == 200:
             print(f"✅ A pasta '{caminho_completo}' já existe no SharePoint.")
             return True
         elif check_response.status_code == 404:
             # A pasta não existe, vamos criá-la
-            create_url = f'https://graph.microsoft.com/v1.0/drives/{drive_id}/root:/{caminho_completo}'
             create_payload = {'name': folder_name, 'folder': {}}
-            create_response = requests.patch(create_url, headers={
-                'Authorization': f'Bearer {access_token}',
+            create_response = graph.patch(check_url, headers={
                 'Content-Type': 'application/json'
             }, data=json.dumps(create_payload))
             if create_response.status_code in [200, 201]:
@@ -210,43 +334,26 @@ def check_and_create_sharepoint_folder(folder_name):
 
 
 def send_to_sharepoint(file_path, file_name, pasta_destino):
-    """Envia o arquivo para uma pasta no SharePoint."""
+    """Envia o arquivo salvo em file_path para uma pasta no SharePoint."""
     try:
-        token_url = f'https://login.microsoftonline.com/{SHAREPOINT_TENANT_ID}/oauth2/v2.0/token'
-        token_data = {
-            'grant_type': 'client_credentials',
-            'client_id': SHAREPOINT_CLIENT_ID,
-            'client_secret': SHAREPOINT_CLIENT_SECRET,
-            'scope': 'https://graph.microsoft.com/.default'
-        }
-        token_response = requests.post(token_url, data=token_data)
-        access_token = token_response.json().get('access_token')
-
-        headers = {'Authorization': f'Bearer {access_token}'}
-
-        domain = SHAREPOINT_SITE_URL.split('/')[2]
-        site_path = '/' + '/'.join(SHAREPOINT_SITE_URL.split('/')[3:])
-        site_id_url = f'https://graph.microsoft.com/v1.0/sites/{domain}:{site_path}'
-        site_id = requests.get(site_id_url, headers=headers).json().get('id')
-
-        drive_url = f'https://graph.microsoft.com/v1.0/sites/{site_id}/drives'
-        drive_response = requests.get(drive_url, headers=headers)
-        drives = drive_response.json().get('value', [])
-        drive_id = next((d['id'] for d in drives if d['name'] == 'Documentos'), None)
+        graph = get_graph_client()
+        drive_id = graph.get_drive_id()
         
         if not drive_id:
             print("❌ Drive 'Documentos' não encontrado.")
             return False
 
         caminho_completo = f'{SHAREPOINT_BASE_PATH}/{pasta_destino}'
-        
-        upload_url = f'https://graph.microsoft.com/v1.0/drives/{drive_id}/root:/{caminho_completo}/{file_name}:/content'
-        
-        with open(file_path, 'rb') as file_content:
-            upload_response = requests.put(upload_url, headers={
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/octet-stream'
-            }, data=file_content)
+
+        def progresso(enviados, total):
+            print(f"⬆️ {file_name}: {enviados * 100 // total}% enviado")
+
+        # Arquivos grandes vão em partes por uma sessão de upload, retomável após falhas
+        upload_response = graph.upload(
+            drive_id, f'{caminho_completo}/{file_name}',
+            caminho_local=file_path,
+            progresso=progresso
+        )
 
         if upload_response.status_code in [200, 201]:
             print('✅ Arquivo enviado para o SharePoint com sucesso!')
@@ -259,13 +366,94 @@ def send_to_sharepoint(file_path, file_name, pasta_destino):
         print(f"❌ Erro na função send_to_sharepoint: {e}")
         return False
 
+# --- Outbox (tarefas pós-geração) ---
+# As tarefas enviam o arquivo já salvo em BASE_PATH (lido do disco no momento do envio):
+# nada fica retido em memória esperando o worker, que pode até rodar em outro processo.
+
+def enfileirar_envio_pendente(conn, chave, caminho_docx, filename_docx, titulo, pasta_nome, email):
+    """Registra o upload do documento para a pasta 'Pendentes' na outbox (dentro da transação de quem chamou)."""
+    outbox.enfileirar(conn, 'upload_sharepoint', {
+        'caminho': caminho_docx,
+        'nome_arquivo': filename_docx,
+        'pasta_destino': "Pendentes",
+        'titulo': titulo,
+        'pasta_nome': pasta_nome,
+        'email': email
+    }, chave)
+
+def tarefa_upload_sharepoint(conn, payload, chave):
+    """Envia o documento ao SharePoint e, com sucesso, enfileira o e-mail de notificação."""
+    if not send_to_sharepoint(payload['caminho'], payload['nome_arquivo'], payload['pasta_destino']):
+        return False
+
+    # Envia o e-mail de notificação (apenas se o upload para o SharePoint for bem-sucedido)
+    if payload.get('email'):
+        corpo_email = f"Olá!\n\nSeu documento PSG foi criado e está pendente de aprovação.\n\nDetalhes do Documento:\n- Título: {payload['titulo']}\n- Pasta: {payload['pasta_nome']}\n\nAguarde o retorno da gestora de LGPD. Obrigado!"
+        outbox.enfileirar(conn, 'email', {
+            'destinatario': payload['email'],
+            'assunto': "Seu PSG está pendente de aprovação.",
+            'corpo': corpo_email
+        }, f"email:{chave}")
+    return True
+
+def enfileirar_envio_lote(conn, chave, itens):
+    """
+    Registra como UMA tarefa da outbox o upload de vários documentos para 'Pendentes'.
+    itens: dicts com caminho, nome_arquivo, titulo, pasta_nome e email.
+    """
+    outbox.enfileirar(conn, 'upload_sharepoint_lote', {
+        'pasta_destino': "Pendentes",
+        'itens': itens
+    }, chave)
+
+def tarefa_upload_sharepoint_lote(conn, payload, chave):
+    """
+    Envia os documentos de um lote ao SharePoint. O progresso fica salvo no payload, então
+    uma nova tentativa só reenvia o que falhou. Ao final, um e-mail por destinatário.
+    """
+    for item in payload['itens']:
+        if item.get('enviado'):
+            continue
+        if send_to_sharepoint(item['caminho'], item['nome_arquivo'], payload['pasta_destino']):
+            item['enviado'] = True
+    outbox.atualizar_payload(conn, chave, payload)
+    if not all(item.get('enviado') for item in payload['itens']):
+        return False
+
+    por_destinatario = {}
+    for item in payload['itens']:
+        if item.get('email'):
+            por_destinatario.setdefault(item['email'], []).append(item)
+    for destinatario, itens in por_destinatario.items():
+        lista = "\n".join(f"- {item['titulo']} ({item['pasta_nome']})" for item in itens)
+        corpo_email = f"Olá!\n\nSeus documentos PSG foram criados e estão pendentes de aprovação.\n\nDocumentos:\n{lista}\n\nAguarde o retorno da gestora de LGPD. Obrigado!"
+        outbox.enfileirar(conn, 'email', {
+            'destinatario': destinatario,
+            'assunto': f"Seus {len(itens)} PSGs estão pendentes de aprovação.",
+            'corpo': corpo_email
+        }, f"email:{chave}:{destinatario}")
+    return True
+
+def tarefa_email(conn, payload, chave):
+    return send_notification_email(payload['destinatario'], payload['assunto'], payload['corpo'])
+
+TAREFAS_OUTBOX = {
+    'upload_sharepoint': tarefa_upload_sharepoint,
+    'upload_sharepoint_lote': tarefa_upload_sharepoint_lote,
+    'email': tarefa_email,
+}
+
 # --- Rotas da API ---
+@app.errorhandler(413)
+def requisicao_grande_demais(error):
+    limite_mb = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return jsonify({"error": f"Requisição maior que o limite de {limite_mb} MB."}), 413
+
 @app.route('/pastas', methods=['GET'])
 def get_pastas():
     """Retorna a lista de pastas e siglas do banco de dados."""
     conn = get_db_connection()
     pastas = conn.execute("SELECT id, nome, sigla FROM pastas").fetchall()
-    conn.close()
     
     pastas_list = [{'id': p['id'], 'nome': p['nome'], 'sigla': p['sigla']} for p in pastas]
     return jsonify(pastas_list)
@@ -295,9 +483,8 @@ def criar_pasta():
         folder_path = os.path.join(BASE_PATH, nome)
         os.makedirs(folder_path, exist_ok=True)
         
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO pastas (nome, sigla) VALUES (?, ?)", (nome, sigla))
-        conn.commit()
+        with banco.transacao(conn):
+            cursor = conn.execute("INSERT INTO pastas (nome, sigla) VALUES (?, ?)", (nome, sigla))
         
         novo_id = cursor.lastrowid
         
@@ -308,28 +495,15 @@ def criar_pasta():
         return jsonify({"error": "Erro: Esta sigla já existe!"}), 409
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/gerar_documento', methods=['POST'])
 def gerar_documento():
     """Recebe os dados do formulário, gera o documento e o envia para download."""
     try:
-        data = request.form
-        
-        titulo = data.get('titulo', '')
-        tema_sigla = data.get('tema', '')
-        folder = json.loads(data.get('folder', '{}'))
-        revisoes = json.loads(data.get('revisoes', '[]'))
-        email = data.get('email', '')
-        
-        objetivo = data.get('objetivo', '')
-        responsabilidades = data.get('responsabilidades', '')
-        conceitosSiglas = data.get('conceitosSiglas', '')
-        diretrizes = data.get('diretrizes', '')
-        documentosComplementares = data.get('documentosComplementares', '')
-        referencias = data.get('referencias', '')
-        
+        campos = ler_campos_documento(request.form)
+        folder = campos['folder']
+        tema_sigla = campos['tema']
+
         pasta_nome = folder.get('nome', '')
         sigla_pasta = folder.get('sigla', 'XXX')
         pasta_id = folder.get('id')
@@ -337,66 +511,13 @@ def gerar_documento():
         if not pasta_nome or not pasta_id:
             return jsonify({"error": "Pasta não selecionada ou inválida."}), 400
 
-        conn = get_db_connection()
-        last_id = conn.execute("SELECT id FROM documentos ORDER BY id DESC LIMIT 1").fetchone()
-        numero_documento = f"{(last_id['id'] if last_id else 0) + 1:02d}"
-        
-        doc = Document()
-        doc = criar_cabecalho(doc, pasta_nome, sigla_pasta, tema_sigla, numero_documento)
-        
-        def configurar_estilo_cabecalho(style, size):
-            style.font.color.rgb = RGBColor(0, 0, 0)
-            style.font.bold = True
-            style.font.size = Pt(size)
-            style.paragraph_format.space_after = Pt(6)
-
-        configurar_estilo_cabecalho(doc.styles['Heading 1'], 16)
-        configurar_estilo_cabecalho(doc.styles['Heading 2'], 14)
-
-        adicionar_secao(doc, "1. OBJETIVO", objetivo)
-        adicionar_secao(doc, "2. RESPONSABILIDADES", responsabilidades)
-        adicionar_secao(doc, "3. CONCEITOS E SIGLAS", conceitosSiglas)
-        adicionar_secao(doc, "4. DIRETRIZES/PROCEDIMENTOS", diretrizes)
-        
-        doc.add_heading("5. ANEXOS", level=2)
-        if request.files and 'anexos' in request.files:
-            uploaded_files = request.files.getlist('anexos')
-            for file_storage in uploaded_files:
-                doc.add_paragraph(f"Arquivo: {file_storage.filename}")
-                try:
-                    para_img = doc.add_paragraph()
-                    run_img = para_img.add_run()
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_storage.filename.split('.')[-1]}") as tmp:
-                        file_storage.save(tmp.name)
-                        tmp_path = tmp.name
-                    
-                    run_img.add_picture(tmp_path, width=Inches(5))
-                    os.unlink(tmp_path)
-                except Exception as e:
-                    doc.add_paragraph(f"Erro ao inserir imagem {file_storage.filename}: {str(e)}")
-        else:
-            doc.add_paragraph("Nenhum anexo de imagem adicionado.")
-
-        adicionar_secao(doc, "6. DOCUMENTOS COMPLEMENTARES", documentosComplementares)
-        adicionar_secao(doc, "7. REFERÊNCIAS", referencias)
-
-        doc.add_heading("8. CONTROLE DE REVISÃO", level=2)
-        if revisoes:
-            table = doc.add_table(rows=1, cols=4)
-            table.style = "Table Grid"
-            hdr_cells = table.rows[0].cells
-            for i, texto in enumerate(["Revisão", "Data", "Responsável", "Alteração"]):
-                hdr_cells[i].text = texto
-                hdr_cells[i].paragraphs[0].runs[0].font.bold = True
-
-            for revisao in revisoes:
-                row = table.add_row().cells
-                row[0].text = numero_documento
-                row[1].text = revisao.get("data", "")
-                row[2].text = revisao.get("responsavel", "")
-                row[3].text = revisao.get("alteracao", "")
-        else:
-            doc.add_paragraph("Nenhuma revisão registrada.")
+        # Reserva o número antes de renderizar: dois pedidos simultâneos nunca
+        # geram o mesmo PSG-{sigla}-{tema}-{nn}.docx
+        numero = reservar_numero_documento(pasta_id, tema_sigla)
+        numero_documento = f"{numero:02d}"
+
+        anexos = request.files.getlist('anexos') if request.files and 'anexos' in request.files else None
+        conteudo_docx = renderizar_documento(campos, numero_documento, anexos)
 
         # Salva o documento localmente
         folder_path = os.path.join(BASE_PATH, pasta_nome)
@@ -405,133 +526,395 @@ def gerar_documento():
 
         filename_docx = f"PSG-{sigla_pasta}-{tema_sigla}-{numero_documento}.docx"
         caminho_docx = os.path.join(folder_path, filename_docx)
-        doc.save(caminho_docx)
+        salvar_arquivo_atomico(caminho_docx, conteudo_docx)
 
         # Salva os dados no banco de dados
         anexos_nomes = [f.filename for f in request.files.getlist('anexos')]
+        valores_doc, valores_status = valores_documento(campos, numero, anexos_nomes)
         
         conn = get_db_connection()
-        conn.execute("""
-            INSERT INTO documentos (pasta_id, titulo, objetivo, responsaveis, conceitos_siglas, diretrizes, documentos_complementares, referencias, revisoes_json, anexos_json, data_criacao, tema_sigla)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            pasta_id, titulo, objetivo, responsabilidades, conceitosSiglas, diretrizes,
-            documentosComplementares, referencias, json.dumps(revisoes), json.dumps(anexos_nomes), datetime.now().strftime("%Y-%m-%d"), tema_sigla
-        ))
-        
-        conn.execute("""
-            INSERT INTO status (pasta_id, pasta_name, status, email)
-            VALUES (?, ?, ?, ?)
-        """, (
-            pasta_id, pasta_nome, "Pendente", email
-        ))
-        conn.commit()
-        conn.close()
-
-        # Envia o documento para o SharePoint
-        sharepoint_folder = "Pendentes"
-        sharepoint_success = send_to_sharepoint(caminho_docx, filename_docx, sharepoint_folder)
-        
-        # Envia o e-mail de notificação (apenas se o upload para o SharePoint for bem-sucedido)
-        if sharepoint_success:
-            corpo_email = f"Olá!\n\nSeu documento PSG foi criado e está pendente de aprovação.\n\nDetalhes do Documento:\n- Título: {titulo}\n- Pasta: {pasta_nome}\n\nAguarde o retorno da gestora de LGPD. Obrigado!"
-            send_notification_email(email, f"Seu PSG está pendente de aprovação.", corpo_email)
-
-        # Envia o arquivo de volta para o front-end
-        doc_io = io.BytesIO()
-        doc.save(doc_io)
-        doc_io.seek(0)
-        
+        with banco.transacao(conn):
+            cursor = conn.execute(SQL_INSERIR_DOCUMENTO, valores_doc)
+            conn.execute(SQL_INSERIR_STATUS, valores_status)
+
+            # Upload para o SharePoint e e-mail saem pela outbox, fora do tempo da requisição
+            enfileirar_envio_pendente(conn, f"upload:documento:{cursor.lastrowid}",
+                                      caminho_docx, filename_docx, campos['titulo'], pasta_nome, campos['email'])
+        outbox.notificar()
+
+        # Envia o arquivo de volta para o front-end (os mesmos bytes salvos em disco)
         return send_file(
-            doc_io,
+            io.BytesIO(conteudo_docx),
             mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
             as_attachment=True,
             download_name=filename_docx
         )
     
+    except anexos_imagem.AnexoGrandeDemais as e:
+        return jsonify({"error": str(e)}), 413
+    except renderizador.RenderizacaoIndisponivel as e:
+        return jsonify({"error": str(e)}), 503
+    except TimeoutError as e:
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
         print(f"Erro na rota gerar_documento: {e}")
         return jsonify({"error": f"Ocorreu um erro no servidor: {str(e)}"}), 500
 
+# --- Geração em lote ---
+MAX_DOCUMENTOS_LOTE = 500
+NUM_WORKERS_LOTE = 4
+
+class _SaidaStream(io.RawIOBase):
+    """Destino do ZipFile no lote: acumula o que foi escrito até o próximo drenar()."""
+    def __init__(self):
+        self.partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        return len(dados)
+
+    def drenar(self):
+        dados = b''.join(self.partes)
+        self.partes.clear()
+        return dados
+
+def ler_itens_lote():
+    """Lê o corpo de /gerar_documentos_lote: array JSON ou NDJSON (um documento por linha)."""
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        return [json.loads(linha) for linha in request.stream if linha.strip()]
+    itens = request.get_json()
+    if not isinstance(itens, list):
+        raise ValueError("O corpo deve ser um array JSON ou NDJSON.")
+    return itens
+
+def renderizar_e_salvar(campos, numero):
+    """Renderiza um documento do lote e o grava em BASE_PATH. Roda nas threads do lote."""
+    folder = campos['folder']
+    numero_documento = f"{numero:02d}"
+    folder_path = os.path.join(BASE_PATH, folder['nome'])
+    os.makedirs(folder_path, exist_ok=True)
+
+    filename_docx = f"PSG-{folder.get('sigla', 'XXX')}-{campos['tema']}-{numero_documento}.docx"
+    caminho_docx = os.path.join(folder_path, filename_docx)
+    conteudo_docx = renderizar_documento(campos, numero_documento)
+    salvar_arquivo_atomico(caminho_docx, conteudo_docx)
+    return caminho_docx, filename_docx, conteudo_docx
+
+def registrar_lote(concluidos):
+    """Grava documentos e status do lote com executemany e enfileira um único envio para todos."""
+    if not concluidos:
+        return
+    valores = [valores_documento(campos, numero, []) for campos, numero, _, _ in concluidos]
+    itens_envio = [{
+        'caminho': caminho, 'nome_arquivo': filename, 'titulo': campos['titulo'],
+        'pasta_nome': campos['folder']['nome'], 'email': campos['email']
+    } for campos, numero, caminho, filename in concluidos]
+    # Números são únicos por (pasta, tema), então os caminhos identificam o lote
+    chave = "upload:lote:" + hashlib.sha1('|'.join(sorted(i['caminho'] for i in itens_envio)).encode('utf-8')).hexdigest()
+
+    conn = get_db_connection()
+    with banco.transacao(conn):
+        conn.executemany(SQL_INSERIR_DOCUMENTO, [documento for documento, _ in valores])
+        conn.executemany(SQL_INSERIR_STATUS, [status for _, status in valores])
+        enfileirar_envio_lote(conn, chave, itens_envio)
+    outbox.notificar()
+
+def gerar_zip_lote(itens):
+    """
+    Renderiza os documentos em paralelo e devolve o ZIP em pedaços, uma entrada por
+    documento assim que ele fica pronto. Falhas individuais vão para 'erros.json' no ZIP.
+    Os registros no banco são gravados ao final, mesmo se o cliente desconectar no meio.
+    """
+    saida = _SaidaStream()
+    futuros = {}
+    coletados = set()
+    concluidos = []
+    erros = []
+    try:
+        with ThreadPoolExecutor(max_workers=NUM_WORKERS_LOTE) as executor, \
+                zipfile.ZipFile(saida, 'w', zipfile.ZIP_STORED) as arquivo_zip:
+            for campos, numero in itens:
+                futuros[executor.submit(renderizar_e_salvar, campos, numero)] = (campos, numero)
+
+            for futuro in as_completed(futuros):
+                coletados.add(futuro)
+                campos, numero = futuros[futuro]
+                try:
+                    caminho, filename, conteudo = futuro.result()
+                except Exception as e:
+                    print(f"❌ Erro ao gerar documento do lote ({campos['titulo']}): {e}")
+                    erros.append({'titulo': campos['titulo'], 'pasta': campos['folder']['nome'], 'erro': str(e)})
+                    continue
+                # Só os caminhos ficam retidos até o fim do lote; os bytes vão direto para o ZIP
+                concluidos.append((campos, numero, caminho, filename))
+                arquivo_zip.writestr(f"{campos['folder']['nome']}/{filename}", conteudo)
+                yield saida.drenar()
+
+            if erros:
+                arquivo_zip.writestr('erros.json', json.dumps(erros, ensure_ascii=False, indent=2))
+        yield saida.drenar()
+    finally:
+        # Cliente desconectado: o executor já esperou os que estavam em andamento
+        for futuro, (campos, numero) in futuros.items():
+            if futuro not in coletados and futuro.done() and futuro.exception() is None:
+                caminho, filename, _ = futuro.result()
+                concluidos.append((campos, numero, caminho, filename))
+        registrar_lote(concluidos)
+
+@app.route('/gerar_documentos_lote', methods=['POST'])
+def gerar_documentos_lote():
+    """
+    Gera vários documentos de uma vez (ex.: migração de procedimentos antigos).
+    Corpo: array JSON ou NDJSON com os mesmos campos do formulário de /gerar_documento
+    (sem anexos). Responde com um ZIP enviado em streaming, com um .docx por documento.
+    """
+    try:
+        itens = [ler_campos_documento(item) for item in ler_itens_lote()]
+    except (ValueError, AttributeError) as e:
+        return jsonify({"error": f"Corpo inválido: {e}"}), 400
+
+    if not itens:
+        return jsonify({"error": "Nenhum documento enviado."}), 400
+    if len(itens) > MAX_DOCUMENTOS_LOTE:
+        return jsonify({"error": f"O lote aceita no máximo {MAX_DOCUMENTOS_LOTE} documentos."}), 413
+    for indice, campos in enumerate(itens):
+        folder = campos['folder']
+        if not isinstance(folder, dict) or not folder.get('nome') or not folder.get('id'):
+            return jsonify({"error": f"Item {indice}: pasta não selecionada ou inválida."}), 400
+
+    # Todos os números do lote reservados em uma única transação
+    primeiros = reservar_numeros_lote(Counter((c['folder']['id'], c['tema']) for c in itens))
+    numerados = []
+    for campos in itens:
+        chave = (campos['folder']['id'], campos['tema'])
+        numerados.append((campos, primeiros[chave]))
+        primeiros[chave] += 1
+
+    return Response(
+        stream_with_context(gerar_zip_lote(numerados)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename=PSGs_lote.zip'}
+    )
+
+
+# Campos que o front-end pode pedir em /documentos_por_pasta (?fields=...) e as colunas que cada um lê
+CAMPOS_DOCUMENTO = {
+    'id': ['id'],
+    'titulo': ['titulo'],
+    'objetivo': ['objetivo'],
+    'responsaveis': ['responsaveis'],
+    'conceitos_siglas': ['conceitos_siglas'],
+    'diretrizes': ['diretrizes'],
+    'documentos_complementares': ['documentos_complementares'],
+    'referencias': ['referencias'],
+    'revisoes': ['revisoes_json'],
+    'anexos': ['anexos_json'],
+    'data_criacao': ['data_criacao'],
+    'tema_sigla': ['tema_sigla'],
+    'full_filename': ['tema_sigla', 'COALESCE(numero, id) AS numero'],
+    'folder': [],
+}
+LIMITE_MAXIMO_PAGINA = 500
+
+def etag_documentos_por_pasta(conn, pasta, parametros):
+    """ETag da listagem: muda quando a pasta ou algum documento dela é criado, alterado ou removido."""
+    resumo = conn.execute("""
+        SELECT COUNT(*) AS total, MAX(id) AS max_id, MAX(atualizado_em) AS ultima_atualizacao
+        FROM documentos WHERE pasta_id = ?
+    """, (pasta['id'],)).fetchone()
+    base = json.dumps([dict(pasta), dict(resumo), parametros], sort_keys=True)
+    return hashlib.sha1(base.encode('utf-8')).hexdigest()
+
 @app.route('/documentos_por_pasta/<int:pasta_id>', methods=['GET'])
 def get_documentos_por_pasta(pasta_id):
-    """Retorna os dados dos documentos para uma pasta específica."""
+    """
+    Retorna os dados dos documentos para uma pasta específica, ordenados por id.
+    Parâmetros opcionais:
+      - fields=id,titulo,full_filename: só os campos pedidos (padrão: todos);
+      - limit=N e after_id=ID: paginação por cursor; se houver mais páginas, o
+        cabeçalho X-Next-After-Id traz o after_id da próxima.
+    Responde 304 quando o If-None-Match do cliente bate com o ETag atual.
+    """
+    campos = request.args.get('fields')
+    campos = [c.strip() for c in campos.split(',') if c.strip()] if campos else list(CAMPOS_DOCUMENTO)
+    invalidos = [c for c in campos if c not in CAMPOS_DOCUMENTO]
+    if invalidos:
+        return jsonify({"error": f"Campos inválidos: {', '.join(invalidos)}"}), 400
+
+    # Valores não numéricos são ignorados (type=int devolve o padrão)
+    limite = request.args.get('limit', type=int)
+    after_id = request.args.get('after_id', 0, type=int)
+    if limite is not None:
+        limite = max(1, min(limite, LIMITE_MAXIMO_PAGINA))
+
     conn = get_db_connection()
-    docs = conn.execute("""
-        SELECT 
-            d.id, d.titulo, d.objetivo, d.responsaveis, d.conceitos_siglas, d.diretrizes, d.documentos_complementares, d.referencias, 
-            d.revisoes_json, d.anexos_json, d.data_criacao, d.tema_sigla,
-            p.id AS pasta_id, p.nome AS pasta_nome, p.sigla AS pasta_sigla
-        FROM documentos d
-        JOIN pastas p ON d.pasta_id = p.id
-        WHERE d.pasta_id = ?
-    """, (pasta_id,)).fetchall()
-    conn.close()
-
-    if not docs:
+    pasta = conn.execute("SELECT id, nome, sigla FROM pastas WHERE id = ?", (pasta_id,)).fetchone()
+    if not pasta:
         return jsonify([])
 
+    etag = etag_documentos_por_pasta(conn, pasta, [campos, limite, after_id])
+    if request.if_none_match.contains(etag):
+        resposta = make_response('', 304)
+        resposta.set_etag(etag)
+        return resposta
+
+    colunas = ['id']
+    for campo in campos:
+        colunas += [c for c in CAMPOS_DOCUMENTO[campo] if c not in colunas]
+    sql = f"SELECT {', '.join(colunas)} FROM documentos WHERE pasta_id = ? AND id > ? ORDER BY id"
+    parametros = [pasta_id, after_id]
+    if limite is not None:
+        # Um a mais só para saber se existe próxima página
+        sql += " LIMIT ?"
+        parametros.append(limite + 1)
+    docs = conn.execute(sql, parametros).fetchall()
+
+    proximo_after_id = None
+    if limite is not None and len(docs) > limite:
+        docs = docs[:limite]
+        proximo_after_id = docs[-1]['id']
+
     docs_list = []
     for doc in docs:
-        doc_dict = dict(doc)
-        
-        # Desserializa os campos JSON de forma segura
-        doc_dict['revisoes'] = json.loads(doc_dict['revisoes_json'] or '[]')
-        doc_dict['anexos'] = json.loads(doc_dict['anexos_json'] or '[]')
-        
-        # Constrói o nome do arquivo
-        sigla_pasta = doc_dict['pasta_sigla']
-        tema_sigla = doc_dict['tema_sigla']
-        numero_documento = doc_dict['id']
-        doc_dict['full_filename'] = f"PSG-{sigla_pasta}-{tema_sigla}-{numero_documento:02d}.docx"
-
-        # Formata o objeto para o front-end
-        doc_dict['folder'] = {
-            'id': doc_dict['pasta_id'],
-            'nome': doc_dict['pasta_nome'],
-            'sigla': doc_dict['pasta_sigla']
-        }
-        
-        del doc_dict['revisoes_json']
-        del doc_dict['anexos_json']
-        del doc_dict['pasta_id']
-        del doc_dict['pasta_nome']
-        del doc_dict['pasta_sigla']
-        
+        doc_dict = {}
+        for campo in campos:
+            if campo == 'revisoes':
+                doc_dict['revisoes'] = json.loads(doc['revisoes_json'] or '[]')
+            elif campo == 'anexos':
+                doc_dict['anexos'] = json.loads(doc['anexos_json'] or '[]')
+            elif campo == 'full_filename':
+                doc_dict['full_filename'] = f"PSG-{pasta['sigla']}-{doc['tema_sigla']}-{doc['numero']:02d}.docx"
+            elif campo == 'folder':
+                doc_dict['folder'] = {'id': pasta['id'], 'nome': pasta['nome'], 'sigla': pasta['sigla']}
+            else:
+                doc_dict[campo] = doc[campo]
         docs_list.append(doc_dict)
-    
-    return jsonify(docs_list)
+
+    resposta = make_response(jsonify(docs_list))
+    resposta.set_etag(etag)
+    # O navegador guarda a resposta mas sempre revalida (e recebe 304 se nada mudou)
+    resposta.headers['Cache-Control'] = 'no-cache'
+    if proximo_after_id is not None:
+        resposta.headers['X-Next-After-Id'] = str(proximo_after_id)
+    return resposta
+
+
+# Pesos do bm25 por coluna de documentos_fts: titulo, objetivo, diretrizes, conceitos_siglas, referencias
+PESOS_BUSCA = (10.0, 5.0, 1.0, 2.0, 1.0)
+# Marcadores internos do snippet, trocados por <mark> depois de escapar o texto
+_INICIO_DESTAQUE, _FIM_DESTAQUE = '\x02', '\x03'
+
+def montar_consulta_fts(texto):
+    """
+    Converte o texto digitado em uma consulta FTS5 segura: cada termo vira uma
+    frase entre aspas com busca por prefixo ("backu"* acha "backup").
+    """
+    termos = re.findall(r'\w+', texto)
+    return ' '.join(f'"{termo}"*' for termo in termos)
+
+def formatar_snippet(snippet):
+    texto = html.escape(snippet or '')
+    return texto.replace(_INICIO_DESTAQUE, '<mark>').replace(_FIM_DESTAQUE, '</mark>')
+
+@app.route('/buscar', methods=['GET'])
+def buscar_documentos():
+    """
+    Busca textual em todos os PSGs (título, objetivo, diretrizes, conceitos e referências).
+    Parâmetros: q (obrigatório), pasta_id (opcional), limit e offset para paginar.
+    Os resultados vêm ordenados por relevância, com um trecho destacado com <mark>.
+    """
+    consulta = montar_consulta_fts(request.args.get('q', ''))
+    if not consulta:
+        return jsonify({"error": "Informe o termo de busca em 'q'."}), 400
+
+    limite = max(1, min(request.args.get('limit', 20, type=int), LIMITE_MAXIMO_PAGINA))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    pasta_id = request.args.get('pasta_id', type=int)
+
+    sql = f"""
+        SELECT d.id, d.titulo, d.tema_sigla, COALESCE(d.numero, d.id) AS numero,
+               p.id AS pasta_id, p.nome AS pasta_nome, p.sigla AS pasta_sigla,
+               snippet(documentos_fts, -1, ?, ?, '…', 16) AS trecho
+        FROM documentos_fts
+        JOIN documentos d ON d.id = documentos_fts.rowid
+        JOIN pastas p ON p.id = d.pasta_id
+        WHERE documentos_fts MATCH ? {'AND d.pasta_id = ?' if pasta_id is not None else ''}
+        ORDER BY bm25(documentos_fts, {', '.join(str(peso) for peso in PESOS_BUSCA)})
+        LIMIT ? OFFSET ?
+    """
+    parametros = [_INICIO_DESTAQUE, _FIM_DESTAQUE, consulta]
+    if pasta_id is not None:
+        parametros.append(pasta_id)
+    # Um a mais só para saber se existe próxima página
+    parametros += [limite + 1, offset]
+
+    conn = get_db_connection()
+    rows = conn.execute(sql, parametros).fetchall()
+
+    resultados = []
+    for row in rows[:limite]:
+        resultados.append({
+            'id': row['id'],
+            'titulo': row['titulo'],
+            'full_filename': f"PSG-{row['pasta_sigla']}-{row['tema_sigla']}-{row['numero']:02d}.docx",
+            'folder': {'id': row['pasta_id'], 'nome': row['pasta_nome'], 'sigla': row['pasta_sigla']},
+            'trecho': formatar_snippet(row['trecho']),
+        })
+
+    return jsonify({
+        'resultados': resultados,
+        'proximo_offset': offset + limite if len(rows) > limite else None,
+    })
 
 
 @app.route('/listar_arquivos/<path:pasta_nome>', methods=['GET'])
 def listar_arquivos(pasta_nome):
-    """Retorna uma lista de nomes de arquivos para uma pasta específica."""
-    
-    base_dir = os.path.join(os.getcwd(), BASE_PATH)
-    
-    pastas_existentes = [d for d in os.listdir(base_dir) if d.lower() == pasta_nome.lower() and os.path.isdir(os.path.join(base_dir, d))]
-    
-    if not pastas_existentes:
+    """Retorna uma lista de nomes de arquivos para uma pasta específica (via índice em memória)."""
+    listagem = indice_diretorios.listar_arquivos(BASE_PATH, pasta_nome)
+    if listagem is None:
         return jsonify({"error": f"Pasta '{pasta_nome}' não encontrada."}), 404
-        
-    pasta_correta = pastas_existentes[0]
-    folder_path = os.path.join(base_dir, pasta_correta)
-        
-    arquivos = [f for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f))]
-    
-    return jsonify({"arquivos": arquivos})
+
+    _, arquivos = listagem
+    return jsonify({"arquivos": sorted(arquivos)})
 
 @app.route('/download/<path:pasta_nome>/<path:filename>', methods=['GET'])
 def download_documento(pasta_nome, filename):
-    """Permite o download de um documento específico."""
-    file_path = os.path.join(BASE_PATH, pasta_nome, filename)
-    if os.path.exists(file_path):
-        return send_file(
-            file_path,
-            as_attachment=True,
-            download_name=os.path.basename(file_path)
-        )
-    return jsonify({"error": "Arquivo não encontrado."}), 404
+    """
+    Permite o download de um documento específico.
+    Responde com ETag/Last-Modified (304 quando nada mudou) e aceita Range; nos modos
+    'x-sendfile' e 'x-accel' os bytes são enviados pelo proxy, não pelo worker Python.
+    """
+    # Rejeita '..', caminhos absolutos e separadores fora do lugar antes de consultar o índice
+    if safe_join(BASE_PATH, pasta_nome, filename) is None or os.path.basename(filename) != filename:
+        return jsonify({"error": "Arquivo não encontrado."}), 404
+
+    info = indice_diretorios.info_arquivo(BASE_PATH, pasta_nome, filename)
+    if not info:
+        return jsonify({"error": "Arquivo não encontrado."}), 404
+
+    if MODO_ENVIO_ARQUIVOS == 'x-accel':
+        # O nginx serve o arquivo (validadores e Range ficam com ele)
+        pasta_real = os.path.basename(os.path.dirname(info['caminho']))
+        resposta = make_response('')
+        resposta.headers['X-Accel-Redirect'] = PREFIXO_X_ACCEL + quote(pasta_real) + '/' + quote(filename)
+        resposta.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+        resposta.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+        return resposta
+
+    # ETag forte a partir de tamanho e mtime (o arquivo é sempre trocado inteiro, via os.replace)
+    etag = f"{info['tamanho']:x}-{info['modificado_em']:x}"
+    return send_file(
+        info['caminho'],
+        as_attachment=True,
+        download_name=filename,
+        conditional=True,
+        etag=etag,
+        last_modified=info['modificado_em'] / 1e9,
+        max_age=0
+    )
 
 @app.route('/atualizar_documento/<int:doc_id>', methods=['PUT'])
 def atualizar_documento(doc_id):
@@ -552,7 +935,6 @@ def atualizar_documento(doc_id):
         """, (doc_id,)).fetchone()
         
         if not original_doc:
-            conn.close()
             return jsonify({"error": "Documento não encontrado para edição."}), 404
             
         data = request.form
@@ -573,71 +955,89 @@ def atualizar_documento(doc_id):
         sigla_pasta = original_doc['sigla_pasta']
         pasta_id = original_doc['pasta_id']
         
-        # Recupera o nome de arquivo original
-        filename_docx = f"PSG-{sigla_pasta}-{tema_sigla}-{original_doc['id']:02d}.docx"
-        
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE documentos SET
-                titulo = ?, objetivo = ?, responsaveis = ?, conceitos_siglas = ?,
-                diretrizes = ?, documentos_complementares = ?, referencias = ?,
-                revisoes_json = ?, tema_sigla = ?
-            WHERE id = ?
-        """, (
-            titulo, objetivo, responsabilidades, conceitosSiglas, diretrizes,
-            documentosComplementares, referencias, json.dumps(revisoes), tema_sigla, doc_id
-        ))
-        
-        cursor.execute("""
-            INSERT INTO status (pasta_id, pasta_name, status, email)
-            VALUES (?, ?, ?, ?)
-        """, (
-            pasta_id, pasta_nome, "Pendente", email
-        ))
-        conn.commit()
-        conn.close()
-        
-        numero_documento = original_doc['id']
-        
-        doc = Document()
-        doc = criar_cabecalho(doc, pasta_nome, sigla_pasta, tema_sigla, numero_documento)
-        
-        def configurar_estilo_cabecalho(style, size):
-            style.font.color.rgb = RGBColor(0, 0, 0)
-            style.font.bold = True
-            style.font.size = Pt(size)
-            style.paragraph_format.space_after = Pt(6)
-
-        configurar_estilo_cabecalho(doc.styles['Heading 1'], 16)
-        configurar_estilo_cabecalho(doc.styles['Heading 2'], 14)
-
-        adicionar_secao(doc, "1. OBJETIVO", objetivo)
-        adicionar_secao(doc, "2. RESPONSABILIDADES", responsabilidades)
-        adicionar_secao(doc, "3. CONCEITOS E SIGLAS", conceitosSiglas)
-        adicionar_secao(doc, "4. DIRETRIZES/PROCEDIMENTOS", diretrizes)
-        
-        doc.add_heading("5. ANEXOS", level=2)
-        doc.add_paragraph("Nenhum anexo de imagem adicionado.")
+        # Recupera o nome de arquivo original (documentos antigos usam o id como número)
+        numero_documento = original_doc['numero'] or original_doc['id']
+        filename_original = f"PSG-{sigla_pasta}-{original_doc['tema_sigla']}-{numero_documento:02d}.docx"
 
-        adicionar_secao(doc, "6. DOCUMENTOS COMPLEMENTARES", documentosComplementares)
-        adicionar_secao(doc, "7. REFERÊNCIAS", referencias)
+        # O número só é único dentro de (pasta, tema): ao trocar de tema, o documento recebe o
+        # próximo número do novo tema, senão sobrescreveria o arquivo de outro documento.
+        # Como em /gerar_documento, a reserva vem antes de renderizar (uma falha deixa só um buraco).
+        if tema_sigla != original_doc['tema_sigla']:
+            numero_documento = reservar_numero_documento(pasta_id, tema_sigla)
+        filename_docx = f"PSG-{sigla_pasta}-{tema_sigla}-{numero_documento:02d}.docx"
 
-        adicionar_secao(doc, "8. CONTROLE DE REVISÃO", json.dumps(revisoes))
-        
+        spec = nova_especificacao(pasta_nome, sigla_pasta, tema_sigla, numero_documento)
+        spec['blocos'] = [
+            ('secao', "1. OBJETIVO", objetivo),
+            ('secao', "2. RESPONSABILIDADES", responsabilidades),
+            ('secao', "3. CONCEITOS E SIGLAS", conceitosSiglas),
+            ('secao', "4. DIRETRIZES/PROCEDIMENTOS", diretrizes),
+            ('titulo', "5. ANEXOS"),
+            ('paragrafo', "Nenhum anexo de imagem adicionado."),
+            ('secao', "6. DOCUMENTOS COMPLEMENTARES", documentosComplementares),
+            ('secao', "7. REFERÊNCIAS", referencias),
+            ('secao', "8. CONTROLE DE REVISÃO", json.dumps(revisoes)),
+        ]
         caminho_docx = os.path.join(BASE_PATH, pasta_nome, filename_docx)
-        doc.save(caminho_docx)
-        
-        doc_io = io.BytesIO()
-        doc.save(doc_io)
-        doc_io.seek(0)
+
+        # A data de aprovação (hoje) fica fora das chaves: só ela mudar não é uma edição.
+        # A versão do modelo entra: logos ou estilos novos pedem uma nova renderização.
+        spec_sem_data = {**spec, 'cabecalho': {**spec['cabecalho'], 'data_aprovacao': None}}
+        chave_render = cache_render.chave(spec_sem_data, modelo_documento.versao_modelo(IMAGEM_ESQUERDA, IMAGEM_DIREITA))
+
+        # Edição sem mudança (mesmo conteúdo, modelo, título e e-mail da última gravação): devolve
+        # os bytes já salvos, sem renderizar, regravar o arquivo ou registrar outro status
+        assinatura = cache_render.chave(chave_render, titulo, email)
+        conteudo_docx = None
+        if original_doc['assinatura_edicao'] == assinatura:
+            conteudo_docx = ler_arquivo(caminho_docx)
+        if conteudo_docx is not None:
+            return enviar_docx(conteudo_docx, filename_docx, assinatura)
+
+        # Renderiza antes de gravar: se o pool recusar o pedido, o banco fica como estava.
+        # Um conteúdo já renderizado antes (ex.: edição desfeita) sai do cache com a data daquela vez.
+        conteudo_docx = cache_render.obter(BASE_PATH, chave_render)
+        novo_no_cache = conteudo_docx is None
+        if novo_no_cache:
+            conteudo_docx = renderizador.renderizar(spec)
         
-        return send_file(
-            doc_io,
-            mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            as_attachment=True,
-            download_name=filename_docx
-        )
+        with banco.transacao(conn):
+            conn.execute("""
+                UPDATE documentos SET
+                    titulo = ?, objetivo = ?, responsaveis = ?, conceitos_siglas = ?,
+                    diretrizes = ?, documentos_complementares = ?, referencias = ?,
+                    revisoes_json = ?, tema_sigla = ?, numero = ?, atualizado_em = ?, assinatura_edicao = ?
+                WHERE id = ?
+            """, (
+                titulo, objetivo, responsabilidades, conceitosSiglas, diretrizes,
+                documentosComplementares, referencias, json.dumps(revisoes), tema_sigla,
+                numero_documento, datetime.now().isoformat(), assinatura, doc_id
+            ))
+            
+            conn.execute("""
+                INSERT INTO status (pasta_id, pasta_name, status, email)
+                VALUES (?, ?, ?, ?)
+            """, (
+                pasta_id, pasta_nome, "Pendente", email
+            ))
 
+        salvar_arquivo_atomico(caminho_docx, conteudo_docx)
+        if novo_no_cache:
+            cache_render.guardar(BASE_PATH, chave_render, caminho_docx)
+        if filename_docx != filename_original:
+            # O arquivo com o nome antigo pertencia só a este documento
+            caminho_original = os.path.join(BASE_PATH, pasta_nome, filename_original)
+            if os.path.exists(caminho_original):
+                os.unlink(caminho_original)
+                indice_diretorios.registrar_escrita(caminho_original)
+        return enviar_docx(conteudo_docx, filename_docx, assinatura)
+
+    except anexos_imagem.AnexoGrandeDemais as e:
+        return jsonify({"error": str(e)}), 413
+    except renderizador.RenderizacaoIndisponivel as e:
+        return jsonify({"error": str(e)}), 503
+    except TimeoutError as e:
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
         print(f"Erro na rota atualizar_documento: {e}")
         return jsonify({"error": f"Ocorreu um erro no servidor: {str(e)}"}), 500
@@ -646,4 +1046,12 @@ def atualizar_documento(doc_id):
 if __name__ == '__main__':
     if not os.path.exists(BASE_PATH):
         os.makedirs(BASE_PATH)
-    app.run(host='0.0.0.0', debug=True)
\ No newline at end of file
+    criar_banco_de_dados(DATABASE)
+
+    # Com o reloader do modo debug, o processo pai só vigia os arquivos: o worker roda no
+    # filho (que atende as requisições). Sem o reloader, roda neste mesmo processo.
+    # Em servidores WSGI este bloco não executa; use python worker_outbox.py.
+    if not MODO_DEBUG or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        outbox.iniciar_worker(get_db_connection, TAREFAS_OUTBOX)
+        renderizador.iniciar(IMAGEM_ESQUERDA, IMAGEM_DIREITA)
+    app.run(host='0.0.0.0', debug=MODO_DEBUG)
\ No newline at end of file
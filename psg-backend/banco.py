@@ -0,0 +1,59 @@
+"""
+Camada de acesso ao SQLite compartilhada pelo app.py e pelo monitor.
+
+- WAL e busy_timeout em toda conexão, para o Flask e o monitor gravarem juntos
+  sem "database is locked";
+- uma conexão reaproveitada por thread (e por banco), em vez de um connect por chamada;
+- conexões em modo autocommit: escritas com mais de um comando usam transacao().
+"""
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+BUSY_TIMEOUT_MS = 5000
+
+_local = threading.local()
+
+
+def conectar(caminho):
+    """Abre uma conexão nova já configurada (WAL, busy_timeout, Row)."""
+    conn = sqlite3.connect(caminho, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def get_connection(caminho):
+    """Retorna a conexão desta thread para o banco 'caminho', abrindo-a na primeira vez."""
+    conexoes = getattr(_local, 'conexoes', None)
+    if conexoes is None:
+        conexoes = _local.conexoes = {}
+    conn = conexoes.get(caminho)
+    if conn is None:
+        conn = conexoes[caminho] = conectar(caminho)
+    return conn
+
+
+def fechar_conexoes():
+    """Fecha as conexões abertas pela thread atual (ex.: ao fim de uma requisição)."""
+    conexoes = getattr(_local, 'conexoes', None) or {}
+    for conn in conexoes.values():
+        conn.close()
+    conexoes.clear()
+
+
+@contextmanager
+def transacao(conn, imediata=False):
+    """
+    Executa o bloco em uma transação: COMMIT no fim, ROLLBACK em caso de erro.
+    imediata=True usa BEGIN IMMEDIATE, que já reserva o lock de escrita.
+    """
+    conn.execute("BEGIN IMMEDIATE" if imediata else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
@@ -0,0 +1,99 @@
+"""
+Cache em disco dos documentos renderizados, endereçado pelo conteúdo.
+
+A chave é o sha256 da especificação normalizada do renderizador (campos, revisões,
+pasta, tema, hashes das imagens; sem a data de aprovação) junto com a versão do modelo
+base. Os bytes ficam em arquivos {chave}.docx dentro de um diretório sob BASE_PATH; o
+mtime de cada arquivo é atualizado a cada leitura e, quando o total passa de
+TAMANHO_MAXIMO_CACHE, os menos usados recentemente são apagados.
+
+Como o documento já é salvo em BASE_PATH, guardar() cria um hard link para ele em vez
+de uma segunda cópia dos bytes (as gravações usam os.replace, então o link continua
+apontando para o conteúdo original mesmo depois que o documento é regravado).
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+NOME_DIRETORIO_CACHE = '.cache_render'
+TAMANHO_MAXIMO_CACHE = 200 * 1024 * 1024
+
+_lock = threading.Lock()
+
+
+def _normalizar(valor):
+    """Bytes (imagens) viram o hash deles; tuplas viram listas."""
+    if isinstance(valor, (bytes, bytearray)):
+        return {'sha256': hashlib.sha256(valor).hexdigest()}
+    if isinstance(valor, dict):
+        return {chave: _normalizar(v) for chave, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_normalizar(v) for v in valor]
+    return valor
+
+
+def chave(*partes):
+    """sha256 da representação JSON canônica das partes (especificação, versão do modelo, ...)."""
+    texto = json.dumps(_normalizar(list(partes)), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+def _diretorio(base_path):
+    return os.path.join(base_path, NOME_DIRETORIO_CACHE)
+
+
+def obter(base_path, chave_render):
+    """Retorna os bytes em cache para a chave (marcando o uso), ou None."""
+    caminho = os.path.join(_diretorio(base_path), f"{chave_render}.docx")
+    try:
+        with open(caminho, 'rb') as arquivo:
+            conteudo = arquivo.read()
+        os.utime(caminho)
+        return conteudo
+    except OSError:
+        return None
+
+
+def guardar(base_path, chave_render, caminho_documento):
+    """
+    Coloca no cache (de forma atômica) o documento salvo em caminho_documento e remove os
+    itens menos usados se passar do limite. Sem suporte a hard link, copia os bytes.
+    """
+    diretorio = _diretorio(base_path)
+    os.makedirs(diretorio, exist_ok=True)
+    caminho_tmp = os.path.join(diretorio, f'.tmp-{os.getpid()}-{threading.get_ident()}-{chave_render}')
+    try:
+        try:
+            os.link(caminho_documento, caminho_tmp)
+        except OSError:
+            shutil.copyfile(caminho_documento, caminho_tmp)
+        os.replace(caminho_tmp, os.path.join(diretorio, f"{chave_render}.docx"))
+    except Exception:
+        if os.path.exists(caminho_tmp):
+            os.unlink(caminho_tmp)
+        raise
+    _limitar_tamanho(diretorio)
+
+
+def _limitar_tamanho(diretorio):
+    with _lock:
+        itens = []
+        total = 0
+        with os.scandir(diretorio) as entradas:
+            for entrada in entradas:
+                if entrada.is_file() and entrada.name.endswith('.docx'):
+                    info = entrada.stat()
+                    itens.append((info.st_mtime_ns, info.st_size, entrada.path))
+                    total += info.st_size
+        if total <= TAMANHO_MAXIMO_CACHE:
+            return
+        for _, tamanho, caminho in sorted(itens):
+            try:
+                os.unlink(caminho)
+            except OSError:
+                continue
+            total -= tamanho
+            if total <= TAMANHO_MAXIMO_CACHE:
+                break
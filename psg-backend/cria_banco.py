@@ -1,13 +1,22 @@
-import sqlite3
 from datetime import datetime
+import banco
 
 # Caminho do banco de dados
 db_path = 'banco.db'
 
-def criar_banco_de_dados():
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
+# --- Migrações versionadas ---
+# Cada migração roda uma única vez; a versão aplicada fica em PRAGMA user_version.
+# Os comandos são idempotentes (IF NOT EXISTS / checagem de coluna) porque bancos
+# criados antes do versionamento estão na versão 0 mas já têm parte das tabelas.
+
+def _adicionar_coluna(cursor, tabela, coluna, definicao):
+    colunas = [c[1] for c in cursor.execute(f"PRAGMA table_info({tabela})").fetchall()]
+    if coluna not in colunas:
+        cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {definicao}")
+        return True
+    return False
+
+def migracao_001_tabelas_base(cursor):
     # Criar a tabela 'pastas'
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS pastas (
@@ -16,7 +25,7 @@ def criar_banco_de_dados():
             sigla TEXT NOT NULL UNIQUE
         )
     ''')
-    
+
     # Criar a tabela 'documentos' com a nova coluna 'email'
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS documentos (
@@ -48,10 +57,194 @@ def criar_banco_de_dados():
             email TEXT
         )
     ''')
-    
-    conn.commit()
-    conn.close()
+
+def migracao_002_estado_monitor(cursor):
+    # Estado persistente do monitor (ex.: último eTag/cTag visto do Status_PSG.xlsx)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS monitor_estado (
+            chave TEXT PRIMARY KEY,
+            valor TEXT,
+            atualizado_em TEXT
+        )
+    ''')
+
+def migracao_003_indice_versoes(cursor):
+    # Índice local das versões aprovadas no SharePoint (mantido via /delta pelo monitor)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS indice_pastas_sp (
+            item_id TEXT PRIMARY KEY,
+            nome TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS indice_arquivos_sp (
+            item_id TEXT PRIMARY KEY,
+            pasta_item_id TEXT,
+            nome TEXT NOT NULL,
+            prefixo TEXT,
+            versao INTEGER
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_indice_arquivos_sp_prefixo
+        ON indice_arquivos_sp (pasta_item_id, prefixo, versao)
+    ''')
+
+def migracao_004_outbox(cursor):
+    # Outbox de tarefas pós-geração (upload para o SharePoint, e-mails)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL,
+            payload_json TEXT,
+            chave TEXT NOT NULL UNIQUE,
+            status TEXT NOT NULL DEFAULT 'pendente',
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            proxima_tentativa TEXT,
+            reservado_em TEXT,
+            ultimo_erro TEXT,
+            criado_em TEXT,
+            concluido_em TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_outbox_pendentes ON outbox (status, proxima_tentativa)
+    ''')
+
+def migracao_005_sequencias(cursor):
+    # Numeração dos documentos: coluna 'numero' em documentos e uma sequência por (pasta, tema).
+    # Documentos antigos eram numerados pelo próprio id, que vira o número deles.
+    _adicionar_coluna(cursor, 'documentos', 'numero', 'INTEGER')
+    cursor.execute("UPDATE documentos SET numero = id WHERE numero IS NULL")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sequencias (
+            pasta_id INTEGER NOT NULL,
+            tema_sigla TEXT NOT NULL,
+            ultimo_numero INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (pasta_id, tema_sigla)
+        )
+    ''')
+    _semear_sequencias(cursor)
+
+def _semear_sequencias(cursor):
+    """Leva cada sequência (pasta, tema) pelo menos até o maior número já usado nos documentos."""
+    cursor.execute('''
+        INSERT INTO sequencias (pasta_id, tema_sigla, ultimo_numero)
+        SELECT pasta_id, tema_sigla, MAX(COALESCE(numero, id)) FROM documentos
+        WHERE pasta_id IS NOT NULL AND tema_sigla IS NOT NULL
+        GROUP BY pasta_id, tema_sigla
+        ON CONFLICT (pasta_id, tema_sigla) DO UPDATE
+        SET ultimo_numero = MAX(ultimo_numero, excluded.ultimo_numero)
+    ''')
+
+def migracao_006_indices(cursor):
+    # Índices das consultas por pasta (listagem de documentos, status, resolução de pasta destino)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documentos_pasta_id ON documentos (pasta_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_status_pasta_id ON status (pasta_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pastas_nome ON pastas (nome)")
+
+def migracao_007_versao_pastas(cursor):
+    # Contador de alterações de 'pastas', lido pelo resolvedor de pasta destino do monitor
+    # para saber quando recarregar o mapa em memória (vale para escritas de qualquer processo)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS versoes_tabelas (
+            tabela TEXT PRIMARY KEY,
+            versao INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO versoes_tabelas (tabela, versao) VALUES ('pastas', 0)")
+    for evento in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_pastas_versao_{evento.lower()} AFTER {evento} ON pastas
+            BEGIN
+                UPDATE versoes_tabelas SET versao = versao + 1 WHERE tabela = 'pastas';
+            END
+        ''')
+
+def migracao_008_atualizado_em(cursor):
+    # Data/hora da última gravação de cada documento (ETag de /documentos_por_pasta)
+    if _adicionar_coluna(cursor, 'documentos', 'atualizado_em', 'TEXT'):
+        cursor.execute("UPDATE documentos SET atualizado_em = data_criacao")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documentos_pasta_atualizado ON documentos (pasta_id, atualizado_em)")
+
+def migracao_009_busca_textual(cursor):
+    # Índice FTS5 (external content) do conteúdo dos PSGs, usado por /buscar.
+    # Triggers mantêm o índice em dia com os INSERT/UPDATE/DELETE em 'documentos'.
+    colunas = 'titulo, objetivo, diretrizes, conceitos_siglas, referencias'
+    cursor.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS documentos_fts USING fts5(
+            {colunas},
+            content='documentos', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    novos = ', '.join(f'new.{c.strip()}' for c in colunas.split(','))
+    antigos = ', '.join(f'old.{c.strip()}' for c in colunas.split(','))
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_documentos_fts_insert AFTER INSERT ON documentos BEGIN
+            INSERT INTO documentos_fts (rowid, {colunas}) VALUES (new.id, {novos});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_documentos_fts_delete AFTER DELETE ON documentos BEGIN
+            INSERT INTO documentos_fts (documentos_fts, rowid, {colunas}) VALUES ('delete', old.id, {antigos});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_documentos_fts_update AFTER UPDATE OF {colunas} ON documentos BEGIN
+            INSERT INTO documentos_fts (documentos_fts, rowid, {colunas}) VALUES ('delete', old.id, {antigos});
+            INSERT INTO documentos_fts (rowid, {colunas}) VALUES (new.id, {novos});
+        END
+    ''')
+    # Indexa os documentos que já existiam
+    cursor.execute("INSERT INTO documentos_fts (documentos_fts) VALUES ('rebuild')")
+
+def migracao_010_assinatura_edicao(cursor):
+    # Assinatura da última versão salva de cada documento (detecta edições sem mudança)
+    _adicionar_coluna(cursor, 'documentos', 'assinatura_edicao', 'TEXT')
+
+def migracao_011_semear_sequencias(cursor):
+    # Bancos que passaram pela 005 antes de ela semear 'sequencias' (a tabela ficava vazia
+    # até o app rodar por python app.py): completa as sequências a partir dos documentos
+    _semear_sequencias(cursor)
+
+MIGRACOES = [
+    (1, migracao_001_tabelas_base),
+    (2, migracao_002_estado_monitor),
+    (3, migracao_003_indice_versoes),
+    (4, migracao_004_outbox),
+    (5, migracao_005_sequencias),
+    (6, migracao_006_indices),
+    (7, migracao_007_versao_pastas),
+    (8, migracao_008_atualizado_em),
+    (9, migracao_009_busca_textual),
+    (10, migracao_010_assinatura_edicao),
+    (11, migracao_011_semear_sequencias),
+]
+
+def aplicar_migracoes(conn):
+    """Aplica, em ordem e cada uma em sua transação, as migrações ainda não aplicadas."""
+    versao_atual = conn.execute("PRAGMA user_version").fetchone()[0]
+    aplicadas = []
+    for versao, migracao in MIGRACOES:
+        if versao <= versao_atual:
+            continue
+        with banco.transacao(conn, imediata=True):
+            migracao(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {versao}")
+        aplicadas.append(versao)
+    return aplicadas
+
+def criar_banco_de_dados(caminho=db_path):
+    conn = banco.conectar(caminho)
+    try:
+        return aplicar_migracoes(conn)
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
-    criar_banco_de_dados()
-    print("Banco de dados e tabelas 'pastas', 'documentos' e 'status' criados com sucesso!")
\ No newline at end of file
+    aplicadas = criar_banco_de_dados()
+    if aplicadas:
+        print(f"Banco de dados atualizado com sucesso! Migrações aplicadas: {aplicadas}")
+    else:
+        print("Banco de dados já está na versão mais recente.")
@@ -0,0 +1,366 @@
+import mmap
+import os
+import threading
+import time
+import urllib.parse
+import requests
+from requests.adapters import HTTPAdapter
+
+GRAPH_URL = 'https://graph.microsoft.com/v1.0'
+
+# Renova o token um pouco antes de expirar, para não usar um token vencido no meio de um ciclo
+MARGEM_EXPIRACAO_TOKEN = 300
+
+# Limite de requisições por chamada ao endpoint /$batch do Graph
+TAMANHO_MAXIMO_BATCH = 20
+
+# Respostas de limitação do Graph: todos os workers pausam pelo Retry-After antes de tentar de novo
+STATUS_THROTTLING = (429, 503)
+MAX_TENTATIVAS_THROTTLING = 5
+
+# Uploads: até LIMITE_UPLOAD_SIMPLES vai em um único PUT .../content; acima disso usa
+# uma sessão de upload (createUploadSession), em partes múltiplas de 320 KiB
+LIMITE_UPLOAD_SIMPLES = 4 * 1024 * 1024
+TAMANHO_PARTE_UPLOAD = 10 * 320 * 1024
+MAX_FALHAS_PARTE_UPLOAD = 5
+
+
+class GraphClient:
+    """
+    Cliente compartilhado do Microsoft Graph, usado pelo app.py e pelo monitor.
+    Mantém o token de acesso em cache até pouco antes de expirar, reutiliza uma
+    requests.Session com keep-alive e memoriza o site ID e o drive ID.
+    """
+
+    def __init__(self, tenant_id, client_id, client_secret, site_url, drive_name='Documentos'):
+        self.tenant_id = tenant_id
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.site_url = site_url
+        self.drive_name = drive_name
+
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+        self._lock = threading.Lock()
+        self._token = None
+        self._token_expira_em = 0
+        self._site_id = None
+        self._drive_id = None
+        self._pausa_ate = 0
+
+    # --- Autenticação ---
+    def get_token(self):
+        """Retorna o token em cache ou busca um novo se estiver perto de expirar."""
+        with self._lock:
+            if self._token and time.time() < self._token_expira_em - MARGEM_EXPIRACAO_TOKEN:
+                return self._token
+
+            token_url = f'https://login.microsoftonline.com/{self.tenant_id}/oauth2/v2.0/token'
+            token_data = {
+                'grant_type': 'client_credentials',
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'scope': 'https://graph.microsoft.com/.default'
+            }
+            token_response = self.session.post(token_url, data=token_data)
+            payload = token_response.json()
+            self._token = payload.get('access_token')
+            self._token_expira_em = time.time() + int(payload.get('expires_in', 3600))
+            return self._token
+
+    def auth_headers(self):
+        return {'Authorization': f'Bearer {self.get_token()}'}
+
+    def invalidar(self, token=False):
+        """Descarta o site ID e o drive ID memorizados (e o token, se pedido)."""
+        with self._lock:
+            self._site_id = None
+            self._drive_id = None
+            if token:
+                self._token = None
+                self._token_expira_em = 0
+
+    # --- Limitação (throttling) ---
+    def aguardar_liberacao(self):
+        """Bloqueia enquanto houver uma pausa de throttling ativa (vale para todas as threads)."""
+        espera = self._pausa_ate - time.time()
+        if espera > 0:
+            time.sleep(espera)
+
+    def registrar_throttling(self, retry_after, tentativa):
+        """
+        Aplica a pausa pedida pelo Graph (Retry-After) a todos os usuários do cliente.
+        Sem o cabeçalho, usa um backoff exponencial.
+        """
+        try:
+            segundos = float(retry_after)
+        except (TypeError, ValueError):
+            segundos = min(2 ** tentativa, 60)
+        with self._lock:
+            self._pausa_ate = max(self._pausa_ate, time.time() + segundos)
+
+    # --- Requisições ---
+    def request(self, method, url, headers=None, **kwargs):
+        """
+        Executa uma chamada ao Graph com o token em cache.
+        Em 401 descarta token e IDs memorizados e tenta mais uma vez (se persistir, os IDs
+        também são descartados, para serem redescobertos na próxima chamada). Um 404 comum
+        (item inexistente) não mexe nos IDs;
+        em 429/503 respeita o Retry-After e tenta de novo até MAX_TENTATIVAS_THROTTLING vezes.
+        """
+        if not url.startswith('http'):
+            url = f'{GRAPH_URL}{url}'
+
+        renovou_token = False
+        tentativa = 0
+        while True:
+            self.aguardar_liberacao()
+            corpo = kwargs.get('data')
+            if hasattr(corpo, 'seek'):
+                corpo.seek(0)
+
+            request_headers = self.auth_headers()
+            if headers:
+                request_headers.update(headers)
+            response = self.session.request(method, url, headers=request_headers, **kwargs)
+
+            if response.status_code == 401 and not renovou_token:
+                renovou_token = True
+                self.invalidar(token=True)
+                continue
+            if response.status_code in STATUS_THROTTLING and tentativa < MAX_TENTATIVAS_THROTTLING:
+                tentativa += 1
+                self.registrar_throttling(response.headers.get('Retry-After'), tentativa)
+                continue
+            if response.status_code == 401:
+                self.invalidar()
+            return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    # --- Site e drive ---
+    def get_site_id(self):
+        site_id = self._site_id
+        if site_id:
+            return site_id
+        domain = self.site_url.split('/')[2]
+        site_path = '/' + '/'.join(self.site_url.split('/')[3:])
+        response = self.get(f'/sites/{domain}:{site_path}')
+        site_id = response.json().get('id') if response.status_code == 200 else None
+        with self._lock:
+            self._site_id = site_id
+        return site_id
+
+    def get_drive_id(self):
+        """Retorna o ID do drive 'Documentos', consultando o Graph apenas na primeira vez."""
+        drive_id = self._drive_id
+        if drive_id:
+            return drive_id
+        site_id = self.get_site_id()
+        if not site_id:
+            return None
+        response = self.get(f'/sites/{site_id}/drives')
+        drives = response.json().get('value', []) if response.status_code == 200 else []
+        drive_id = next((d['id'] for d in drives if d['name'] == self.drive_name), None)
+        with self._lock:
+            self._drive_id = drive_id
+        return drive_id
+
+    def drive_path_url(self, drive_id, file_path, suffix=''):
+        """
+        Monta a URL de um item do drive endereçado pelo caminho, com cada segmento
+        percent-encoded (espaços, acentos, '#', '?', '%'). Necessário nas sub-requisições
+        do /$batch, que não passam pela codificação do requests.
+        """
+        return f'/drives/{drive_id}/root:/{urllib.parse.quote(file_path, safe="/")}{suffix}'
+
+    def move_item(self, drive_id, source_path, destination_folder_path, new_name=None, conflict_behavior='replace'):
+        """
+        Move um item dentro do drive sem baixar o conteúdo (PATCH em parentReference/name).
+        conflict_behavior: 'replace', 'rename' ou 'fail', aplicado quando o destino já existe.
+        Retorna a resposta do Graph (200 com o driveItem movido em caso de sucesso).
+        """
+        body = {'parentReference': {'path': f'/drives/{drive_id}/root:/{destination_folder_path}'}}
+        if new_name:
+            body['name'] = new_name
+        return self.patch(
+            self.drive_path_url(drive_id, source_path),
+            params={'@microsoft.graph.conflictBehavior': conflict_behavior},
+            json=body
+        )
+
+    # --- Upload de arquivos ---
+    def upload(self, drive_id, item_path, caminho_local=None, conteudo=None,
+               conflict_behavior='replace', progresso=None):
+        """
+        Envia um arquivo para 'item_path' no drive, a partir de bytes em memória ('conteudo')
+        ou de um arquivo local ('caminho_local'). Arquivos pequenos vão em um único PUT;
+        os maiores usam uma sessão de upload, lendo o arquivo local por mmap, uma parte por vez.
+        progresso(enviados, total) é chamado após cada parte aceita.
+        Retorna a resposta final do Graph (200/201 com o driveItem em caso de sucesso).
+        """
+        tamanho = len(conteudo) if conteudo is not None else os.path.getsize(caminho_local)
+        if tamanho <= LIMITE_UPLOAD_SIMPLES:
+            url = self.drive_path_url(drive_id, item_path, ':/content')
+            headers = {'Content-Type': 'application/octet-stream'}
+            params = {'@microsoft.graph.conflictBehavior': conflict_behavior}
+            if conteudo is not None:
+                return self.put(url, headers=headers, params=params, data=conteudo)
+            with open(caminho_local, 'rb') as arquivo:
+                return self.put(url, headers=headers, params=params, data=arquivo)
+
+        sessao = self.post(
+            self.drive_path_url(drive_id, item_path, ':/createUploadSession'),
+            json={'item': {'@microsoft.graph.conflictBehavior': conflict_behavior}}
+        )
+        if sessao.status_code != 200:
+            return sessao
+        upload_url = sessao.json()['uploadUrl']
+
+        if conteudo is not None:
+            return self._enviar_partes(upload_url, memoryview(conteudo), progresso)
+        with open(caminho_local, 'rb') as arquivo, \
+                mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ) as dados:
+            return self._enviar_partes(upload_url, dados, progresso)
+
+    def _proximo_inicio(self, upload_url):
+        """Consulta a sessão de upload e retorna o primeiro byte que o Graph ainda espera."""
+        response = self.session.get(upload_url)
+        if response.status_code != 200:
+            return None
+        faixas = response.json().get('nextExpectedRanges') or []
+        return int(faixas[0].split('-')[0]) if faixas else None
+
+    def _enviar_partes(self, upload_url, dados, progresso=None):
+        """
+        Envia 'dados' (mmap ou memoryview) em partes de TAMANHO_PARTE_UPLOAD para a sessão.
+        A uploadUrl já é pré-autenticada: as partes vão sem o cabeçalho Authorization.
+        Após erros transitórios, retoma do nextExpectedRanges informado pelo Graph.
+        """
+        total = len(dados)
+        inicio = 0
+        falhas = 0
+        while True:
+            fim = min(inicio + TAMANHO_PARTE_UPLOAD, total)
+            self.aguardar_liberacao()
+            try:
+                response = self.session.put(upload_url, data=bytes(dados[inicio:fim]), headers={
+                    'Content-Length': str(fim - inicio),
+                    'Content-Range': f'bytes {inicio}-{fim - 1}/{total}',
+                })
+            except requests.RequestException as e:
+                response = None
+                erro = str(e)
+
+            if response is not None and response.status_code in (200, 201):
+                if progresso:
+                    progresso(total, total)
+                return response
+
+            if response is not None and response.status_code == 202:
+                falhas = 0
+                faixas = response.json().get('nextExpectedRanges') or []
+                inicio = int(faixas[0].split('-')[0]) if faixas else fim
+                if progresso:
+                    progresso(inicio, total)
+                continue
+
+            if response is not None and response.status_code == 404:
+                # Sessão expirada ou cancelada: quem chamou precisa começar uma nova
+                return response
+
+            falhas += 1
+            if response is not None:
+                erro = f'status {response.status_code}'
+                if response.status_code in STATUS_THROTTLING:
+                    self.registrar_throttling(response.headers.get('Retry-After'), falhas)
+            if falhas > MAX_FALHAS_PARTE_UPLOAD:
+                print(f"❌ Upload em partes interrompido após {falhas} falhas ({erro}).")
+                if response is None:
+                    raise requests.ConnectionError(f"Upload em partes interrompido: {erro}")
+                return response
+            if response is None or response.status_code not in STATUS_THROTTLING:
+                time.sleep(min(2 ** falhas, 30))
+
+            # Retoma de onde o Graph parou (a parte pode ter sido recebida apesar do erro)
+            try:
+                proximo = self._proximo_inicio(upload_url)
+            except requests.RequestException:
+                proximo = None
+            if proximo is not None:
+                inicio = proximo
+
+    # --- JSON batching ---
+    def batch(self, grupos):
+        """
+        Envia requisições pelo endpoint /$batch, no máximo TAMANHO_MAXIMO_BATCH por chamada.
+        grupos: lista de listas de requisições ({'id', 'method', 'url', ...}); as requisições
+        de um mesmo grupo (ex.: ligadas por 'dependsOn') nunca são separadas entre lotes.
+        Requisições individuais limitadas (429/503) são reenviadas após o Retry-After,
+        junto com as que falharam por depender delas (424).
+        Retorna um dict id -> resposta individual ({'id', 'status', 'headers', 'body'}).
+        """
+        respostas = self._enviar_grupos(grupos)
+
+        for tentativa in range(1, MAX_TENTATIVAS_THROTTLING + 1):
+            reenvio = []
+            retry_after = None
+            for grupo in grupos:
+                limitadas = [r for r in grupo if respostas.get(r['id'], {}).get('status') in STATUS_THROTTLING]
+                if not limitadas:
+                    continue
+                for r in limitadas:
+                    retry_after = retry_after or (respostas[r['id']].get('headers') or {}).get('Retry-After')
+                pendentes = [r for r in grupo
+                             if respostas.get(r['id'], {}).get('status') in STATUS_THROTTLING + (424,)]
+                ids_pendentes = {r['id'] for r in pendentes}
+                # Dependências já concluídas saem do 'dependsOn' (precisam estar no mesmo lote)
+                reenvio.append([self._sem_dependencias_concluidas(r, ids_pendentes) for r in pendentes])
+            if not reenvio:
+                break
+            self.registrar_throttling(retry_after, tentativa)
+            respostas.update(self._enviar_grupos(reenvio))
+
+        return respostas
+
+    @staticmethod
+    def _sem_dependencias_concluidas(requisicao, ids_pendentes):
+        dependencias = [d for d in requisicao.get('dependsOn', []) if d in ids_pendentes]
+        requisicao = {k: v for k, v in requisicao.items() if k != 'dependsOn'}
+        if dependencias:
+            requisicao['dependsOn'] = dependencias
+        return requisicao
+
+    def _enviar_grupos(self, grupos):
+        respostas = {}
+        lote = []
+        for grupo in grupos:
+            if lote and len(lote) + len(grupo) > TAMANHO_MAXIMO_BATCH:
+                respostas.update(self._enviar_batch(lote))
+                lote = []
+            lote.extend(grupo)
+        if lote:
+            respostas.update(self._enviar_batch(lote))
+        return respostas
+
+    def _enviar_batch(self, requisicoes):
+        response = self.post('/$batch', json={'requests': requisicoes})
+        if response.status_code != 200:
+            # Falha do lote inteiro: cada requisição herda o status da chamada
+            return {r['id']: {'id': r['id'], 'status': response.status_code, 'body': None}
+                    for r in requisicoes}
+        return {r['id']: r for r in response.json().get('responses', [])}
@@ -0,0 +1,104 @@
+"""
+Índice em memória das pastas de documentos locais (BASE_PATH).
+
+Guarda o nome real de cada pasta (a busca é sem diferenciar maiúsculas) e, por pasta,
+a lista de arquivos com tamanho e data de modificação, lidos uma vez com os.scandir.
+Cada consulta só faz um stat da pasta: se o mtime do diretório mudou (arquivo criado,
+removido ou renomeado), a entrada é relida. As gravações do próprio app chamam
+registrar_escrita() para não depender da resolução do mtime do sistema de arquivos.
+"""
+import os
+import threading
+
+_lock = threading.Lock()
+# base absoluta -> {'mtime': ..., 'pastas': {nome_minusculo: nome_real}}
+_bases = {}
+# caminho absoluto da pasta -> {'mtime': ..., 'arquivos': {nome: {'tamanho', 'modificado_em'}}}
+_pastas = {}
+
+
+def _mtime(caminho):
+    try:
+        return os.stat(caminho).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _ler_base(base):
+    pastas = {}
+    with os.scandir(base) as entradas:
+        for entrada in entradas:
+            # Diretórios ocultos (ex.: cache de renderização) não são pastas de documentos
+            if entrada.is_dir() and not entrada.name.startswith('.'):
+                pastas.setdefault(entrada.name.lower(), entrada.name)
+    return pastas
+
+
+def _ler_pasta(caminho):
+    arquivos = {}
+    with os.scandir(caminho) as entradas:
+        for entrada in entradas:
+            # Arquivos ocultos (ex.: .tmp-*.docx de uma gravação atômica em andamento) não são documentos
+            if entrada.is_file() and not entrada.name.startswith('.'):
+                info = entrada.stat()
+                arquivos[entrada.name] = {'tamanho': info.st_size, 'modificado_em': info.st_mtime_ns}
+    return arquivos
+
+
+def _resolver_pasta(base, pasta_nome):
+    """Retorna o caminho real da pasta (sem diferenciar maiúsculas), ou None. Chamar com _lock."""
+    base = os.path.abspath(base)
+    mtime = _mtime(base)
+    if mtime is None:
+        return None
+    entrada = _bases.get(base)
+    if entrada is None or entrada['mtime'] != mtime:
+        entrada = _bases[base] = {'mtime': mtime, 'pastas': _ler_base(base)}
+    nome_real = entrada['pastas'].get(pasta_nome.lower())
+    return os.path.join(base, nome_real) if nome_real else None
+
+
+def _arquivos_da_pasta(caminho):
+    """Retorna o dict de arquivos da pasta, relendo-a se o diretório mudou. Chamar com _lock."""
+    mtime = _mtime(caminho)
+    if mtime is None:
+        _pastas.pop(caminho, None)
+        return None
+    entrada = _pastas.get(caminho)
+    if entrada is None or entrada['mtime'] != mtime:
+        entrada = _pastas[caminho] = {'mtime': mtime, 'arquivos': _ler_pasta(caminho)}
+    return entrada['arquivos']
+
+
+def listar_arquivos(base, pasta_nome):
+    """
+    Retorna (caminho_real_da_pasta, {nome: {'tamanho', 'modificado_em'}}) ou None se a pasta
+    não existir. O dict devolvido é uma cópia.
+    """
+    with _lock:
+        caminho = _resolver_pasta(base, pasta_nome)
+        if caminho is None:
+            return None
+        arquivos = _arquivos_da_pasta(caminho)
+        return (caminho, dict(arquivos)) if arquivos is not None else None
+
+
+def info_arquivo(base, pasta_nome, nome_arquivo):
+    """Retorna {'caminho', 'tamanho', 'modificado_em'} de um arquivo indexado, ou None."""
+    with _lock:
+        caminho = _resolver_pasta(base, pasta_nome)
+        if caminho is None:
+            return None
+        arquivos = _arquivos_da_pasta(caminho)
+        info = (arquivos or {}).get(nome_arquivo)
+        if info is None:
+            return None
+        return {'caminho': os.path.join(caminho, nome_arquivo), **info}
+
+
+def registrar_escrita(caminho_arquivo):
+    """Descarta as entradas afetadas por um arquivo que o próprio app acabou de gravar."""
+    pasta = os.path.dirname(os.path.abspath(caminho_arquivo))
+    with _lock:
+        _pastas.pop(pasta, None)
+        _bases.pop(os.path.dirname(pasta), None)
@@ -0,0 +1,145 @@
+"""
+Índice local das versões aprovadas no SharePoint.
+
+Mantém, em banco.db, as pastas destino (filhas diretas de SHAREPOINT_BASE_PATH) e os
+arquivos PSG-*.docx de cada uma, com a versão já extraída do nome. O índice é atualizado
+com a API /delta do Graph: o deltaLink fica salvo em monitor_estado e cada sincronização
+traz apenas o que mudou desde a anterior.
+"""
+import json
+from datetime import datetime
+import banco
+
+CHAVE_DELTA_LINK = 'indice_versoes_delta_link'
+CHAVE_PASTA_BASE = 'indice_versoes_pasta_base_id'
+
+
+def extrair_versao(nome_arquivo):
+    """Extrai o número final de 'PSG-...-{versao}.docx', ou None se não for numérico."""
+    try:
+        return int(nome_arquivo.split('-')[-1].replace('.docx', ''))
+    except (ValueError, IndexError):
+        return None
+
+
+def extrair_prefixo(nome_arquivo):
+    """'PSG-PYT-ABC-05.docx' -> 'PSG-PYT-ABC'."""
+    return '-'.join(nome_arquivo.split('-')[:-1])
+
+
+def _ler_estado(conn, chave):
+    row = conn.execute("SELECT valor FROM monitor_estado WHERE chave = ?", (chave,)).fetchone()
+    return json.loads(row['valor']) if row else None
+
+
+def _salvar_estado(conn, chave, valor):
+    conn.execute(
+        "INSERT OR REPLACE INTO monitor_estado (chave, valor, atualizado_em) VALUES (?, ?, ?)",
+        (chave, json.dumps(valor), datetime.now().isoformat())
+    )
+
+
+def _limpar_indice(conn):
+    conn.execute("DELETE FROM indice_pastas_sp")
+    conn.execute("DELETE FROM indice_arquivos_sp")
+    conn.execute("DELETE FROM monitor_estado WHERE chave IN (?, ?)", (CHAVE_DELTA_LINK, CHAVE_PASTA_BASE))
+
+
+def registrar_item(conn, item, pasta_base_id):
+    """Aplica ao índice um driveItem vindo do /delta (ou da resposta de um move)."""
+    item_id = item['id']
+    parent_id = (item.get('parentReference') or {}).get('id')
+
+    if 'deleted' in item:
+        remover_item(conn, item_id)
+        return
+
+    if 'folder' in item:
+        if parent_id == pasta_base_id:
+            conn.execute("INSERT OR REPLACE INTO indice_pastas_sp (item_id, nome) VALUES (?, ?)",
+                         (item_id, item['name']))
+        else:
+            # Pasta saiu da pasta base (ou nunca esteve nela)
+            conn.execute("DELETE FROM indice_pastas_sp WHERE item_id = ?", (item_id,))
+        return
+
+    nome = item.get('name', '')
+    if 'file' in item and nome.upper().startswith('PSG-') and nome.lower().endswith('.docx'):
+        conn.execute("""
+            INSERT OR REPLACE INTO indice_arquivos_sp (item_id, pasta_item_id, nome, prefixo, versao)
+            VALUES (?, ?, ?, ?, ?)
+        """, (item_id, parent_id, nome, extrair_prefixo(nome), extrair_versao(nome)))
+    else:
+        conn.execute("DELETE FROM indice_arquivos_sp WHERE item_id = ?", (item_id,))
+
+
+def remover_item(conn, item_id):
+    conn.execute("DELETE FROM indice_arquivos_sp WHERE item_id = ?", (item_id,))
+    conn.execute("DELETE FROM indice_pastas_sp WHERE item_id = ?", (item_id,))
+
+
+def sincronizar(conn, graph, drive_id, base_path):
+    """
+    Traz as alterações do drive desde o último deltaLink salvo e aplica no índice.
+    Na primeira execução (ou após um 410 do Graph) faz a varredura completa.
+    Retorna True se o índice ficou atualizado.
+    """
+    pasta_base_id = _ler_estado(conn, CHAVE_PASTA_BASE)
+    if not pasta_base_id:
+        response = graph.get(graph.drive_path_url(drive_id, base_path), params={'$select': 'id'})
+        if response.status_code != 200:
+            print(f"❌ Erro ao localizar a pasta base '{base_path}' para o índice. Status: {response.status_code}")
+            return False
+        pasta_base_id = response.json()['id']
+
+    url = (_ler_estado(conn, CHAVE_DELTA_LINK)
+           or f'/drives/{drive_id}/root/delta?$select=id,name,parentReference,file,folder,deleted')
+    itens = []
+    while url:
+        response = graph.get(url)
+        if response.status_code == 410:
+            # Token de delta expirado: o Graph exige ressincronização completa
+            print("Aviso: deltaLink expirado, reconstruindo o índice de versões.")
+            with banco.transacao(conn):
+                _limpar_indice(conn)
+            return sincronizar(conn, graph, drive_id, base_path)
+        if response.status_code != 200:
+            print(f"❌ Erro ao sincronizar o índice de versões. Status: {response.status_code}")
+            return False
+
+        pagina = response.json()
+        itens.extend(pagina.get('value', []))
+        url = pagina.get('@odata.nextLink')
+        delta_link = pagina.get('@odata.deltaLink')
+
+    # Pastas primeiro, para que a ordem das páginas não importe
+    itens.sort(key=lambda item: 'folder' not in item)
+    with banco.transacao(conn):
+        for item in itens:
+            registrar_item(conn, item, pasta_base_id)
+        _salvar_estado(conn, CHAVE_PASTA_BASE, pasta_base_id)
+        _salvar_estado(conn, CHAVE_DELTA_LINK, delta_link)
+    return True
+
+
+def versao_antiga_para_remover(conn, pasta_nome, nome_documento_completo):
+    """
+    Mesma regra do monitor: entre os arquivos com o mesmo prefixo na pasta destino e o
+    documento que acabou de chegar, se o mais recente não for o novo, ele deve ser removido.
+    Retorna {'id', 'name'} ou None, com uma única consulta local.
+    """
+    row = conn.execute("""
+        SELECT a.item_id, a.nome, a.versao
+        FROM indice_arquivos_sp a
+        JOIN indice_pastas_sp p ON a.pasta_item_id = p.item_id
+        WHERE p.nome = ? AND a.prefixo = ? AND a.nome != ? AND a.versao IS NOT NULL
+        ORDER BY a.versao DESC
+        LIMIT 1
+    """, (pasta_nome, extrair_prefixo(nome_documento_completo), nome_documento_completo)).fetchone()
+    if not row:
+        return None
+
+    versao_nova = extrair_versao(nome_documento_completo)
+    if versao_nova is None or row['versao'] > versao_nova:
+        return {'id': row['item_id'], 'name': row['nome']}
+    return None
@@ -0,0 +1,162 @@
+"""
+Modelo base (pré-compilado) dos documentos PSG.
+
+O modelo já traz margens, estilos dos títulos e a tabela do cabeçalho com os logos
+embutidos. Ele é montado uma vez, guardado em memória como bytes .docx e cada
+documento novo é um clone desses bytes, onde só os campos variáveis do cabeçalho
+(título, código, revisão e data) são preenchidos.
+O cache é refeito quando os arquivos de logo ou as configurações de estilo mudam.
+"""
+import hashlib
+import io
+import os
+import threading
+from datetime import datetime
+from docx import Document
+from docx.shared import RGBColor, Pt, Inches
+from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_PARAGRAPH_ALIGNMENT
+from docx.oxml.ns import qn
+from docx.oxml import OxmlElement
+
+# --- Configurações de layout e estilo ---
+MARGEM = Inches(0.5)
+ESTILOS_TITULO = {'Heading 1': 16, 'Heading 2': 14}
+LARGURA_IMAGEM_ESQUERDA = Inches(0.8)
+LARGURA_IMAGEM_DIREITA = Inches(0.6)
+
+_lock = threading.Lock()
+_cache = {'chave': None, 'modelo': None}
+
+
+def configurar_estilo_cabecalho(style, size):
+    style.font.color.rgb = RGBColor(0, 0, 0)
+    style.font.bold = True
+    style.font.size = Pt(size)
+    style.paragraph_format.space_after = Pt(6)
+
+
+def _assinatura_arquivo(caminho):
+    try:
+        info = os.stat(caminho)
+        return (caminho, info.st_mtime_ns, info.st_size)
+    except OSError:
+        return (caminho, None, None)
+
+
+def _chave_cache(imagem_esquerda, imagem_direita):
+    return (
+        _assinatura_arquivo(imagem_esquerda),
+        _assinatura_arquivo(imagem_direita),
+        MARGEM, tuple(sorted(ESTILOS_TITULO.items())),
+        LARGURA_IMAGEM_ESQUERDA, LARGURA_IMAGEM_DIREITA,
+    )
+
+
+def construir_modelo(imagem_esquerda, imagem_direita):
+    """Monta o documento base (margens, estilos, cabeçalho com logos) e retorna os bytes .docx."""
+    doc = Document()
+    section = doc.sections[0]
+    section.top_margin = MARGEM
+    section.bottom_margin = MARGEM
+    section.left_margin = MARGEM
+    section.right_margin = MARGEM
+
+    header = section.header
+    for paragraph in header.paragraphs:
+        paragraph.clear()
+
+    tabela = header.add_table(rows=1, cols=3, width=Inches(7.5))
+    colunas = tabela.columns
+    colunas[0].width = Inches(0.2)
+    colunas[1].width = Inches(0.2)
+    colunas[2].width = Inches(0.2)
+
+    tbl = tabela._tbl
+    tblPr = tbl.tblPr
+    tblCellMar = OxmlElement('w:tblCellMar')
+    for tag in ['top', 'left', 'bottom', 'right']:
+        elem = OxmlElement(f'w:{tag}')
+        elem.set(qn('w:w'), '0')
+        elem.set(qn('w:type'), 'dxa')
+        tblCellMar.append(elem)
+    tblPr.append(tblCellMar)
+
+    linha = tabela.rows[0].cells
+
+    try:
+        para_img_esq = linha[0].paragraphs[0]
+        run_img_esq = para_img_esq.add_run()
+        run_img_esq.add_picture(imagem_esquerda, width=LARGURA_IMAGEM_ESQUERDA)
+        para_img_esq.alignment = WD_ALIGN_PARAGRAPH.LEFT
+        para_img_esq.paragraph_format.space_before = Pt(0)
+        para_img_esq.paragraph_format.space_after = Pt(0)
+    except Exception as e:
+        print(f"Erro ao adicionar imagem da esquerda: {e}")
+
+    # Os textos do centro ficam vazios no modelo; preencher_cabecalho completa por documento
+    conteudo_central = linha[1].paragraphs[0]
+    run_titulo = conteudo_central.add_run("")
+    run_titulo.bold = True
+    run_titulo.font.size = Pt(12)
+
+    run_linha = conteudo_central.add_run("_" * 99 + "\n")
+    run_linha.font.size = Pt(10)
+    run_linha.font.bold = True
+
+    run_info = conteudo_central.add_run("")
+    run_info.font.size = Pt(10)
+    run_info.bold = True
+    conteudo_central.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+
+    try:
+        para_img_dir = linha[2].paragraphs[0]
+        run_img_dir = para_img_dir.add_run()
+        run_img_dir.add_picture(imagem_direita, width=LARGURA_IMAGEM_DIREITA)
+        para_img_dir.alignment = WD_PARAGRAPH_ALIGNMENT.RIGHT
+        para_img_dir.paragraph_format.space_before = Pt(0)
+        para_img_dir.paragraph_format.space_after = Pt(0)
+    except Exception as e:
+        print(f"Erro ao adicionar imagem da direita: {e}")
+
+    for nome_estilo, tamanho in ESTILOS_TITULO.items():
+        configurar_estilo_cabecalho(doc.styles[nome_estilo], tamanho)
+
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def obter_modelo(imagem_esquerda, imagem_direita):
+    """Retorna os bytes do modelo base, reconstruindo-o só se logos ou estilos mudaram."""
+    chave = _chave_cache(imagem_esquerda, imagem_direita)
+    with _lock:
+        if _cache['chave'] != chave:
+            _cache['modelo'] = construir_modelo(imagem_esquerda, imagem_direita)
+            _cache['chave'] = chave
+        return _cache['modelo']
+
+
+def versao_modelo(imagem_esquerda, imagem_direita):
+    """Identificador da versão atual do modelo (muda junto com o cache: logos ou estilos)."""
+    chave = repr(_chave_cache(imagem_esquerda, imagem_direita))
+    return hashlib.sha256(chave.encode('utf-8')).hexdigest()
+
+
+def preencher_cabecalho(doc, titulo_pasta, sigla_pasta, tema_sigla, numero_documento, data_aprovacao=None):
+    """Preenche os campos variáveis do cabeçalho de um clone do modelo (data padrão: hoje)."""
+    conteudo_central = doc.sections[0].header.tables[0].rows[0].cells[1].paragraphs[0]
+    run_titulo, _, run_info = conteudo_central.runs[:3]
+
+    run_titulo.text = f"PSG - {titulo_pasta} - {tema_sigla}\n"
+
+    codigo_psg = f"PSG.{sigla_pasta}.{tema_sigla}.{numero_documento}"
+    data_aprovacao = data_aprovacao or datetime.now().strftime("%d/%m/%Y")
+    run_info.text = f"{codigo_psg}\t| Rev.\t{numero_documento}\t| Aprovação:\t{data_aprovacao}|"
+    return doc
+
+
+def novo_documento(titulo_pasta, sigla_pasta, tema_sigla, numero_documento, imagem_esquerda, imagem_direita,
+                   data_aprovacao=None):
+    """Cria um documento a partir de um clone em memória do modelo base, com o cabeçalho preenchido."""
+    doc = Document(io.BytesIO(obter_modelo(imagem_esquerda, imagem_direita)))
+    return preencher_cabecalho(doc, titulo_pasta, sigla_pasta, tema_sigla, numero_documento, data_aprovacao)
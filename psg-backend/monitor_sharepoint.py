@@ -1,97 +1,290 @@
 import os
-import requests
-import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 import schedule
 import time
-import io
-import sqlite3
+import banco
 import json
+import secrets
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from graph_client import GraphClient
+from cria_banco import criar_banco_de_dados
+import indice_versoes
+import resolvedor_pastas
+import planilha_status
+import webhook_monitor
 
 # --- Nomes das pastas no SharePoint ---
 PASTA_PENDENTES = 'Pendentes'
 PASTA_REPROVADOS = 'Reprovados'
 
+# --- Transferência dos documentos processados ---
+# 'mover': move o item no próprio SharePoint (nenhum byte passa pelo monitor)
+# 'copiar': comportamento antigo (baixa, reenvia e apaga o original)
+MODO_TRANSFERENCIA = 'mover'
+# Política quando já existe um arquivo com o mesmo nome no destino: 'replace', 'rename' ou 'fail'
+POLITICA_CONFLITO = 'replace'
+
+# --- Execução do ciclo ---
+# 'lote': agrupa as operações das linhas no endpoint /$batch do Graph (exige MODO_TRANSFERENCIA = 'mover')
+# 'concorrente': processa as linhas em paralelo com NUM_WORKERS threads
+# 'sequencial': processa uma linha por vez
+MODO_EXECUCAO = 'lote'
+NUM_WORKERS = 4
+
+# Usa o índice local (mantido pela API /delta) para achar a versão antiga a remover,
+# em vez de listar a pasta destino a cada documento aprovado
+USAR_INDICE_VERSOES = True
+
+# Impede que um ciclo comece enquanto o anterior ainda está rodando
+_ciclo_lock = threading.Lock()
+
+# --- Disparo dos ciclos ---
+# MODO_DISPARO:
+#   'polling' -> a cada 1 minuto;
+#   'webhook' -> por notificações do Graph (receptor em WEBHOOK_PORTA, exposto em HTTPS como
+#                WEBHOOK_URL_PUBLICA), com polling a cada INTERVALO_POLLING_SEGURANCA minutos
+#                como rede de segurança. Sem WEBHOOK_URL_PUBLICA o receptor sobe sem assinatura
+#                (útil com o notificador falso: python webhook_monitor.py --simular --url ...).
+MODO_DISPARO = 'polling'
+WEBHOOK_URL_PUBLICA = ''
+WEBHOOK_PORTA = 8081
+INTERVALO_POLLING_SEGURANCA = 15
+# Rajadas de notificações viram um ciclo só: 10 s após a última, no máximo 60 s após a primeira
+DEBOUNCE_SEGUNDOS = 10
+DEBOUNCE_ESPERA_MAXIMA = 60
+CHAVE_CLIENT_STATE = 'webhook_client_state'
+
 # --- Configurações do Banco de Dados ---
 DATABASE = 'banco.db'
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Conexão da thread atual (reaproveitada, com WAL e busy_timeout)."""
+    return banco.get_connection(DATABASE)
+
+def ler_estado(chave):
+    """Lê um valor (JSON) salvo na tabela monitor_estado, ou None se não existir."""
+    row = get_db_connection().execute("SELECT valor FROM monitor_estado WHERE chave = ?", (chave,)).fetchone()
+    return json.loads(row['valor']) if row else None
+
+def salvar_estado(chave, valor):
+    """Grava (ou substitui) um valor na tabela monitor_estado."""
+    get_db_connection().execute(
+        "INSERT OR REPLACE INTO monitor_estado (chave, valor, atualizado_em) VALUES (?, ?, ?)",
+        (chave, json.dumps(valor), datetime.now().isoformat())
+    )
+
+# --- Funções de Acesso ao SharePoint (via cliente Graph compartilhado) ---
+_graph_client = None
+
+def get_graph_client():
+    """Retorna o cliente Graph do monitor, criado na primeira chamada."""
+    global _graph_client
+    if _graph_client is None:
+        _graph_client = GraphClient(SHAREPOINT_TENANT_ID, SHAREPOINT_CLIENT_ID,
+                                    SHAREPOINT_CLIENT_SECRET, SHAREPOINT_SITE_URL)
+    return _graph_client
 
-# --- Funções de Acesso ao SharePoint (reutilizadas e adaptadas) ---
 def get_sharepoint_auth_headers():
-    token_url = f'https://login.microsoftonline.com/{SHAREPOINT_TENANT_ID}/oauth2/v2.0/token'
-    token_data = {
-        'grant_type': 'client_credentials',
-        'client_id': SHAREPOINT_CLIENT_ID,
-        'client_secret': SHAREPOINT_CLIENT_SECRET,
-        'scope': 'https://graph.microsoft.com/.default'
-    }
-    token_response = requests.post(token_url, data=token_data)
-    access_token = token_response.json().get('access_token')
-    return {'Authorization': f'Bearer {access_token}'}
+    return get_graph_client().auth_headers()
 
 def get_sharepoint_drive_id():
-    headers = get_sharepoint_auth_headers()
-    domain = SHAREPOINT_SITE_URL.split('/')[2]
-    site_path = '/' + '/'.join(SHAREPOINT_SITE_URL.split('/')[3:])
-    site_id_url = f'https://graph.microsoft.com/v1.0/sites/{domain}:{site_path}'
-    site_id = requests.get(site_id_url, headers=headers).json().get('id')
-    drive_url = f'https://graph.microsoft.com/v1.0/sites/{site_id}/drives'
-    drive_response = requests.get(drive_url, headers=headers)
-    drives = drive_response.json().get('value', [])
-    return next((d['id'] for d in drives if d['name'] == 'Documentos'), None)
+    return get_graph_client().get_drive_id()
 
 def get_sharepoint_item_id(drive_id, file_path):
-    headers = get_sharepoint_auth_headers()
-    item_url = f'https://graph.microsoft.com/v1.0/drives/{drive_id}/root:/{file_path}'
-    response = requests.get(item_url, headers=headers)
+    graph = get_graph_client()
+    response = graph.get(graph.drive_path_url(drive_id, file_path))
     return response.json().get('id', None) if response.status_code == 200 else None
 
 def delete_sharepoint_item(drive_id, item_id):
-    headers = get_sharepoint_auth_headers()
-    delete_url = f'https://graph.microsoft.com/v1.0/drives/{drive_id}/items/{item_id}'
-    response = requests.delete(delete_url, headers=headers)
+    response = get_graph_client().delete(f'/drives/{drive_id}/items/{item_id}')
     return response.status_code == 204
 
+def get_sharepoint_item_metadata(drive_id, file_path):
+    """Busca só os metadados de um item (sem o conteúdo), incluindo eTag/cTag."""
+    graph = get_graph_client()
+    response = graph.get(graph.drive_path_url(drive_id, file_path),
+                         params={'$select': 'id,eTag,cTag,lastModifiedDateTime,size'})
+    return response.json() if response.status_code == 200 else None
+
 def get_sharepoint_file_content(drive_id, file_path):
-    headers = get_sharepoint_auth_headers()
-    download_url = f'https://graph.microsoft.com/v1.0/drives/{drive_id}/root:/{file_path}:/content'
-    response = requests.get(download_url, headers=headers)
+    graph = get_graph_client()
+    response = graph.get(graph.drive_path_url(drive_id, file_path, ':/content'))
     return response.content if response.status_code == 200 else None
 
 def upload_sharepoint_file(drive_id, file_name, file_content, destination_folder):
-    headers = get_sharepoint_auth_headers()
-    headers['Content-Type'] = 'application/octet-stream'
-    upload_url = f'https://graph.microsoft.com/v1.0/drives/{drive_id}/root:/{SHAREPOINT_BASE_PATH}/{destination_folder}/{file_name}:/content'
-    response = requests.put(upload_url, headers=headers, data=file_content)
+    # Acima de LIMITE_UPLOAD_SIMPLES o GraphClient usa uma sessão de upload em partes
+    response = get_graph_client().upload(
+        drive_id, f'{SHAREPOINT_BASE_PATH}/{destination_folder}/{file_name}', conteudo=file_content
+    )
     return response.status_code in [200, 201]
 
+# --- Status_PSG.xlsx pela API de workbook do Graph ---
+def _valor_celula(valor):
+    return str(valor).strip() if valor is not None else ''
+
+def remover_linhas_tabela(drive_id, item_id, linhas_processadas):
+    """
+    Remove do Status_PSG.xlsx, direto no SharePoint, só as linhas já tratadas, usando uma
+    sessão da API de workbook. As linhas são localizadas pelo conteúdo atual da tabela
+    (Nome + Status), não pela posição lida no início do ciclo, então linhas adicionadas
+    pela governança durante o ciclo são preservadas. As exclusões vão da última para a
+    primeira, para os índices não se deslocarem.
+    linhas_processadas: lista de (nome, status).
+    Retorna True/False, ou None se a planilha não tiver uma tabela (usar a reescrita).
+    """
+    graph = get_graph_client()
+    base_url = f'/drives/{drive_id}/items/{item_id}/workbook'
+
+    sessao = graph.post(f'{base_url}/createSession', json={'persistChanges': True})
+    if sessao.status_code not in (200, 201):
+        print(f"❌ Erro ao abrir sessão no Status_PSG.xlsx. Status: {sessao.status_code}")
+        return False
+    headers = {'workbook-session-id': sessao.json()['id']}
+
+    try:
+        tabelas = graph.get(f'{base_url}/tables', headers=headers, params={'$select': 'id,name'})
+        if tabelas.status_code != 200:
+            print(f"❌ Erro ao listar as tabelas do Status_PSG.xlsx. Status: {tabelas.status_code}")
+            return False
+
+        for tabela in tabelas.json().get('value', []):
+            tabela_url = f"{base_url}/tables/{tabela['id']}"
+            cabecalho = graph.get(f'{tabela_url}/headerRowRange', headers=headers, params={'$select': 'values'})
+            if cabecalho.status_code != 200:
+                continue
+            colunas = [_valor_celula(v) for v in cabecalho.json()['values'][0]]
+            if 'Nome' in colunas and 'Status' in colunas:
+                break
+        else:
+            return None
+        col_nome, col_status = colunas.index('Nome'), colunas.index('Status')
+
+        corpo = graph.get(f'{tabela_url}/dataBodyRange', headers=headers, params={'$select': 'values'})
+        if corpo.status_code != 200:
+            print(f"❌ Erro ao ler as linhas da tabela do Status_PSG.xlsx. Status: {corpo.status_code}")
+            return False
+
+        # Cada linha tratada remove uma ocorrência (a primeira) com o mesmo Nome e Status
+        restantes = Counter((_valor_celula(nome), _valor_celula(status)) for nome, status in linhas_processadas)
+        indices = []
+        for indice, valores in enumerate(corpo.json().get('values', [])):
+            chave = (_valor_celula(valores[col_nome]), _valor_celula(valores[col_status]))
+            if restantes[chave] > 0:
+                restantes[chave] -= 1
+                indices.append(indice)
+
+        sucesso = True
+        for indice in sorted(indices, reverse=True):
+            response = graph.delete(f'{tabela_url}/rows/itemAt(index={indice})', headers=headers)
+            if response.status_code != 204:
+                print(f"❌ Erro ao remover a linha {indice} do Status_PSG.xlsx. Status: {response.status_code}")
+                sucesso = False
+        return sucesso
+    finally:
+        graph.post(f'{base_url}/closeSession', headers=headers)
+
+def move_sharepoint_file(drive_id, source_path, destination_folder, file_name):
+    """Move o arquivo para a pasta destino no próprio SharePoint, aplicando a POLITICA_CONFLITO."""
+    response = get_graph_client().move_item(
+        drive_id, source_path, f'{SHAREPOINT_BASE_PATH}/{destination_folder}',
+        new_name=file_name, conflict_behavior=POLITICA_CONFLITO
+    )
+    if response.status_code != 200:
+        print(f"❌ Erro ao mover '{source_path}'. Status: {response.status_code} \n\n {response.text}")
+    return response.status_code == 200
+
+def transferir_documento(drive_id, pending_file_path, file_name, destination_folder):
+    """
+    Leva o documento da pasta Pendentes para a pasta destino conforme o MODO_TRANSFERENCIA.
+    Retorna True se o documento saiu de Pendentes e está no destino.
+    """
+    if MODO_TRANSFERENCIA == 'mover':
+        return move_sharepoint_file(drive_id, pending_file_path, destination_folder, file_name)
+
+    file_content = get_sharepoint_file_content(drive_id, pending_file_path)
+    if not file_content:
+        print(f"Aviso: Arquivo '{file_name}' não encontrado na pasta '{PASTA_PENDENTES}'.")
+        return False
+    if not upload_sharepoint_file(drive_id, file_name, file_content, destination_folder):
+        return False
+
+    # Remover da pasta Pendente
+    item_id_to_delete = get_sharepoint_item_id(drive_id, pending_file_path)
+    if item_id_to_delete and delete_sharepoint_item(drive_id, item_id_to_delete):
+        print(f"✅ Documento original removido da pasta '{PASTA_PENDENTES}'.")
+    return True
+
+def escolher_versao_mais_recente(files, file_prefix):
+    latest_file = None
+    latest_version = -1
+
+    for file in files:
+        if file['name'].startswith(file_prefix):
+            version = indice_versoes.extrair_versao(file['name'])
+            if version is not None and version > latest_version:
+                latest_version = version
+                latest_file = file
+    return latest_file
+
+def list_sharepoint_folder(drive_id, destination_folder, first_page=None):
+    """
+    Lista todos os itens da pasta destino, seguindo @odata.nextLink
+    (o Graph devolve no máximo 200 itens por página).
+    first_page: primeira página já obtida (ex.: via /$batch), para continuar a partir dela.
+    """
+    graph = get_graph_client()
+    if first_page is None:
+        folder_url = graph.drive_path_url(drive_id, f'{SHAREPOINT_BASE_PATH}/{destination_folder}', ':/children')
+        response = graph.get(folder_url, params={'$select': 'id,name'})
+        if response.status_code != 200:
+            return None
+        first_page = response.json()
+
+    files = list(first_page.get('value', []))
+    next_link = first_page.get('@odata.nextLink')
+    while next_link:
+        response = graph.get(next_link)
+        if response.status_code != 200:
+            return None
+        page = response.json()
+        files.extend(page.get('value', []))
+        next_link = page.get('@odata.nextLink')
+    return files
+
 def find_latest_approved_version(drive_id, file_prefix, destination_folder):
-    headers = get_sharepoint_auth_headers()
-    folder_url = f'https://graph.microsoft.com/v1.0/drives/{drive_id}/root:/{SHAREPOINT_BASE_PATH}/{destination_folder}/children'
-    response = requests.get(folder_url, headers=headers)
-    
-    if response.status_code == 200:
-        files = response.json().get('value', [])
-        latest_file = None
-        latest_version = -1
-
-        for file in files:
-            if file['name'].startswith(file_prefix):
-                try:
-                    version_str = file['name'].split('-')[-1].replace('.docx', '')
-                    version = int(version_str)
-                    if version > latest_version:
-                        latest_version = version
-                        latest_file = file
-                except (ValueError, IndexError):
-                    continue
-        return latest_file
+    files = list_sharepoint_folder(drive_id, destination_folder)
+    if files is not None:
+        return escolher_versao_mais_recente(files, file_prefix)
     return None
 
+def sincronizar_indice_versoes(drive_id):
+    """Atualiza o índice local de versões com as mudanças do drive (API /delta)."""
+    return indice_versoes.sincronizar(get_db_connection(), get_graph_client(), drive_id, SHAREPOINT_BASE_PATH)
+
+def buscar_versao_antiga(drive_id, nome_documento_completo, pasta_destino):
+    """
+    Retorna o arquivo ({'id', 'name'}) que deve ser removido da pasta destino depois
+    que nome_documento_completo chegar lá, ou None.
+    """
+    if USAR_INDICE_VERSOES:
+        return indice_versoes.versao_antiga_para_remover(get_db_connection(), pasta_destino, nome_documento_completo)
+
+    prefix = indice_versoes.extrair_prefixo(nome_documento_completo)
+    latest_approved_file = find_latest_approved_version(drive_id, prefix, pasta_destino)
+    if latest_approved_file and latest_approved_file['name'] != nome_documento_completo:
+        return latest_approved_file
+    return None
+
+def remover_do_indice(item_id):
+    """Tira do índice local uma versão antiga apagada pelo próprio monitor (o /delta confirma depois)."""
+    if not USAR_INDICE_VERSOES:
+        return
+    conn = get_db_connection()
+    with banco.transacao(conn):
+        indice_versoes.remover_item(conn, item_id)
+
 def extract_pasta_token_from_filename(nome_documento_sem_extensao: str) -> str | None:
     """
     Espera nomes no formato: PSG-{pasta_token}-{tema_sigla}-{versao}
@@ -104,61 +297,280 @@ def extract_pasta_token_from_filename(nome_documento_sem_extensao: str) -> str |
 
 def get_pasta_destino_from_filename(nome_documento_sem_extensao: str) -> str | None:
     """
-    Tenta resolver o nome da pasta destino consultando a tabela 'pastas'.
-    Estratégia:
+    Tenta resolver o nome da pasta destino a partir da tabela 'pastas'.
+    Estratégia (ver resolvedor_pastas, que mantém o mapa em memória):
       1) extrai token (segundo padrão PSG-...)
       2) se token for numérico -> busca por id
-      3) se token for texto -> tenta colunas comuns (sigla, codigo)
-      4) fallback -> busca por nome contendo token
-      5) último recurso -> antigo lookup via tabela 'documentos' (mantém compatibilidade)
+      3) se token for texto -> tenta colunas comuns (sigla, codigo, ...)
+      4) fallback -> nome contendo token
+      5) sem token -> antigo lookup via tabela 'documentos' (mantém compatibilidade)
     Retorna pasta.nome (string) ou None se não encontrar.
     """
     token = extract_pasta_token_from_filename(nome_documento_sem_extensao)
-
     conn = get_db_connection()
-    try:
-        # Se não conseguimos extrair token, mantemos o comportamento antigo:
-        if token is None:
-            row = conn.execute(
-                "SELECT p.nome AS pasta_original FROM documentos d "
-                "JOIN pastas p ON d.pasta_id = p.id WHERE d.titulo = ?",
-                (nome_documento_sem_extensao,)
-            ).fetchone()
-            return row['pasta_original'] if row else None
-
-        # 1) token numérico -> procura por id
-        try:
-            pid = int(token)
-            row = conn.execute("SELECT nome FROM pastas WHERE id = ?", (pid,)).fetchone()
-            if row:
-                return row['nome']
-        except ValueError:
-            # token não é número -> continua
-            pass
-
-        # 2) token textual -> tenta colunas comuns (se a coluna não existir, ignora erro)
-        for col in ('sigla', 'codigo', 'abreviacao', 'codigo_pasta'):
-            try:
-                row = conn.execute(f"SELECT nome FROM pastas WHERE {col} = ? COLLATE NOCASE", (token,)).fetchone()
-                if row:
-                    return row['nome']
-            except sqlite3.OperationalError:
-                # coluna não existe, ignora e continua
+
+    # Se não conseguimos extrair token, mantemos o comportamento antigo:
+    if token is None:
+        row = conn.execute(
+            "SELECT p.nome AS pasta_original FROM documentos d "
+            "JOIN pastas p ON d.pasta_id = p.id WHERE d.titulo = ?",
+            (nome_documento_sem_extensao,)
+        ).fetchone()
+        return row['pasta_original'] if row else None
+
+    return resolvedor_pastas.resolver(conn, token)
+
+
+# Status da planilha que exigem alguma ação no SharePoint
+STATUS_ACIONAVEIS = ('Aprovado', 'Reprovado')
+
+# Chave em monitor_estado com a última versão (eTag/cTag) processada do Status_PSG.xlsx
+CHAVE_ESTADO_PLANILHA = 'status_psg_versao'
+
+# Linhas que falharam (arquivo pendente sumiu, sigla sem pasta...) são tentadas de novo
+# com espera exponencial, sem obrigar o download da planilha a cada ciclo
+CHAVE_FALHAS_LINHAS = 'status_psg_falhas'
+ESPERA_INICIAL_FALHA = 60
+ESPERA_MAXIMA_FALHA = 3600
+
+def _chave_linha(nome, status):
+    return f"{status}:{nome}"
+
+def _tentativa_liberada(falha, agora):
+    return falha is None or datetime.fromisoformat(falha['proxima_tentativa']) <= agora
+
+def atualizar_falhas_linhas(falhas_anteriores, tentadas, processadas, presentes, agora):
+    """
+    Retorna o novo registro de falhas {chave_linha: {'tentativas', 'proxima_tentativa'}}:
+    linhas processadas saem, linhas tentadas sem sucesso ganham uma espera maior e
+    linhas que não estão mais na planilha são esquecidas.
+    """
+    falhas = {chave: falha for chave, falha in falhas_anteriores.items() if chave in presentes}
+    for chave in tentadas:
+        if chave in processadas:
+            falhas.pop(chave, None)
+            continue
+        tentativas = falhas.get(chave, {}).get('tentativas', 0) + 1
+        espera = min(ESPERA_INICIAL_FALHA * 2 ** (tentativas - 1), ESPERA_MAXIMA_FALHA)
+        falhas[chave] = {
+            'tentativas': tentativas,
+            'proxima_tentativa': (agora + timedelta(seconds=espera)).isoformat()
+        }
+    return falhas
+
+def processar_linha(drive_id, nome_documento_sem_extensao, status):
+    """
+    Executa a ação de uma linha 'Aprovado' ou 'Reprovado' da planilha.
+    Retorna True se o documento foi tratado e a linha pode sair do Excel.
+    """
+    nome_documento_completo = f"{nome_documento_sem_extensao}.docx"
+    pending_file_path = f'{SHAREPOINT_BASE_PATH}/{PASTA_PENDENTES}/{nome_documento_completo}'
+
+    if status == 'Aprovado':
+        print(f"Documento '{nome_documento_completo}' Aprovado. Processando...")
+
+        pasta_destino = get_pasta_destino_from_filename(nome_documento_sem_extensao)
+        if not pasta_destino:
+            print(f"❌ Erro: Não foi possível encontrar a pasta destino para '{nome_documento_sem_extensao}'.")
+            return False
+
+        if not transferir_documento(drive_id, pending_file_path, nome_documento_completo, pasta_destino):
+            print(f"❌ Erro ao mover o documento '{nome_documento_completo}'.")
+            return False
+        print(f"✅ Documento '{nome_documento_completo}' movido para a pasta '{pasta_destino}'.")
+
+        # Remover versão antiga
+        latest_approved_file = buscar_versao_antiga(drive_id, nome_documento_completo, pasta_destino)
+        if latest_approved_file:
+            old_item_id = latest_approved_file['id']
+            if delete_sharepoint_item(drive_id, old_item_id):
+                remover_do_indice(old_item_id)
+                print(f"✅ Versão antiga '{latest_approved_file['name']}' removida.")
+        return True
+
+    print(f"Documento '{nome_documento_completo}' Reprovado. Processando...")
+    if not transferir_documento(drive_id, pending_file_path, nome_documento_completo, PASTA_REPROVADOS):
+        print(f"❌ Erro ao mover o documento '{nome_documento_completo}'.")
+        return False
+    print(f"✅ Documento '{nome_documento_completo}' movido para a pasta '{PASTA_REPROVADOS}'.")
+    return True
+
+def processar_linhas_em_lote(drive_id, linhas):
+    """
+    Processa as linhas acionáveis via /$batch: primeiro descobre as versões antigas
+    (pelo índice local ou listando as pastas destino), depois envia, por linha, o move e (dependendo dele) a exclusão da versão antiga.
+    linhas: lista de (index, nome_sem_extensao, status).
+    Retorna (índices processados, quantidade de falhas).
+    """
+    graph = get_graph_client()
+    falhas = 0
+    planos = []  # (index, nome_completo, pasta_destino)
+
+    for index, nome_documento_sem_extensao, status in linhas:
+        nome_documento_completo = f"{nome_documento_sem_extensao}.docx"
+        if status == 'Aprovado':
+            pasta_destino = get_pasta_destino_from_filename(nome_documento_sem_extensao)
+            if not pasta_destino:
+                print(f"❌ Erro: Não foi possível encontrar a pasta destino para '{nome_documento_sem_extensao}'.")
+                falhas += 1
                 continue
+        else:
+            pasta_destino = PASTA_REPROVADOS
+        planos.append((index, nome_documento_completo, pasta_destino, status))
+
+    # 1) Sem o índice local, lista as pastas destino dos aprovados (uma por pasta, no mesmo lote)
+    arquivos_por_pasta = {}
+    if not USAR_INDICE_VERSOES:
+        pastas_aprovados = sorted({p[2] for p in planos if p[3] == 'Aprovado'})
+        listagens = graph.batch([[{
+            'id': f'pasta-{i}',
+            'method': 'GET',
+            'url': graph.drive_path_url(drive_id, f'{SHAREPOINT_BASE_PATH}/{pasta}', ':/children') + '?$select=id,name'
+        }] for i, pasta in enumerate(pastas_aprovados)])
+        for i, pasta in enumerate(pastas_aprovados):
+            resposta = listagens.get(f'pasta-{i}', {})
+            if resposta.get('status') == 200:
+                # Pastas com mais de 200 itens continuam pelo @odata.nextLink
+                arquivos_por_pasta[pasta] = list_sharepoint_folder(drive_id, pasta, first_page=resposta.get('body') or {}) or []
+            else:
+                arquivos_por_pasta[pasta] = []
+
+    # 2) Move + exclusão da versão antiga, encadeados por 'dependsOn' dentro de cada linha
+    grupos = []
+    versoes_antigas = {}
+    for index, nome_documento_completo, pasta_destino, status in planos:
+        id_mover = f'{index}-mover'
+        grupo = [{
+            'id': id_mover,
+            'method': 'PATCH',
+            'url': graph.drive_path_url(drive_id, f'{SHAREPOINT_BASE_PATH}/{PASTA_PENDENTES}/{nome_documento_completo}')
+                   + f'?@microsoft.graph.conflictBehavior={POLITICA_CONFLITO}',
+            'headers': {'Content-Type': 'application/json'},
+            'body': {
+                'parentReference': {'path': f'/drives/{drive_id}/root:/{SHAREPOINT_BASE_PATH}/{pasta_destino}'},
+                'name': nome_documento_completo
+            }
+        }]
 
-        # 3) fallback: buscar por nome que contenha o token
-        row = conn.execute("SELECT nome FROM pastas WHERE nome LIKE ? COLLATE NOCASE", (f"%{token}%",)).fetchone()
-        if row:
-            return row['nome']
+        if status == 'Aprovado':
+            if USAR_INDICE_VERSOES:
+                latest_approved_file = buscar_versao_antiga(drive_id, nome_documento_completo, pasta_destino)
+            else:
+                # Mesma regra de find_latest_approved_version, considerando o arquivo que vai chegar
+                prefix = indice_versoes.extrair_prefixo(nome_documento_completo)
+                candidatos = [f for f in arquivos_por_pasta[pasta_destino] if f['name'] != nome_documento_completo]
+                candidatos.append({'name': nome_documento_completo, 'id': None})
+                latest_approved_file = escolher_versao_mais_recente(candidatos, prefix)
+                if latest_approved_file and latest_approved_file['name'] == nome_documento_completo:
+                    latest_approved_file = None
+            if latest_approved_file:
+                versoes_antigas[index] = latest_approved_file
+                grupo.append({
+                    'id': f'{index}-versao-antiga',
+                    'method': 'DELETE',
+                    'url': f"/drives/{drive_id}/items/{latest_approved_file['id']}",
+                    'dependsOn': [id_mover]
+                })
+        grupos.append(grupo)
+
+    respostas = graph.batch(grupos)
+
+    processadas = []
+    for index, nome_documento_completo, pasta_destino, status in planos:
+        resposta_mover = respostas.get(f'{index}-mover', {})
+        if resposta_mover.get('status') != 200:
+            print(f"❌ Erro ao mover o documento '{nome_documento_completo}'. Status: {resposta_mover.get('status')}")
+            falhas += 1
+            continue
+        print(f"✅ Documento '{nome_documento_completo}' movido para a pasta '{pasta_destino}'.")
+        if index in versoes_antigas and respostas.get(f'{index}-versao-antiga', {}).get('status') == 204:
+            remover_do_indice(versoes_antigas[index]['id'])
+            print(f"✅ Versão antiga '{versoes_antigas[index]['name']}' removida.")
+        processadas.append(index)
 
-        # 4) nada encontrado
-        return None
-    finally:
-        conn.close()
+    return processadas, falhas
 
+def processar_linhas_concorrente(drive_id, linhas):
+    """
+    Processa as linhas em um pool de NUM_WORKERS threads. O throttling do Graph
+    (429/503) pausa todos os workers, pois o cliente Graph é compartilhado.
+    Retorna (índices processados, quantidade de falhas) só depois que todos terminarem.
+    """
+    processadas = []
+    falhas = 0
+    with ThreadPoolExecutor(max_workers=NUM_WORKERS) as executor:
+        futuros = {
+            executor.submit(processar_linha, drive_id, nome, status): index
+            for index, nome, status in linhas
+        }
+        for futuro in as_completed(futuros):
+            try:
+                sucesso = futuro.result()
+            except Exception as e:
+                print(f"❌ Erro inesperado ao processar a linha {futuros[futuro]}: {e}")
+                sucesso = False
+            if sucesso:
+                processadas.append(futuros[futuro])
+            else:
+                falhas += 1
+    return sorted(processadas), falhas
 
-# --- Ajuste em processar_aprovacoes: substitui a busca antiga pelo novo resolvedor ---
-def processar_aprovacoes():
+# Pedido de novo ciclo feito enquanto outro rodava (notificação que não pode se perder)
+_ciclo_pendente = threading.Event()
+
+def processar_aprovacoes(reexecutar_se_ocupado=False):
+    """
+    Executa um ciclo do monitor; se o ciclo anterior ainda estiver rodando, não faz nada.
+    Com reexecutar_se_ocupado=True (disparo por notificação), o ciclo em andamento roda
+    mais uma vez ao terminar, para não perder alterações feitas durante ele.
+    """
+    if reexecutar_se_ocupado:
+        _ciclo_pendente.set()
+    while True:
+        if not _ciclo_lock.acquire(blocking=False):
+            print(f"[{datetime.now()}] Ciclo anterior ainda em execução. Pulando esta verificação.")
+            return
+        try:
+            _ciclo_pendente.clear()
+            executar_ciclo()
+        finally:
+            _ciclo_lock.release()
+        if not _ciclo_pendente.is_set():
+            return
+
+def obter_client_state():
+    """Segredo enviado na assinatura e conferido em cada notificação (gerado uma vez)."""
+    client_state = ler_estado(CHAVE_CLIENT_STATE)
+    if not client_state:
+        client_state = secrets.token_urlsafe(32)
+        salvar_estado(CHAVE_CLIENT_STATE, client_state)
+    return client_state
+
+def renovar_assinatura_webhook():
+    """Cria ou renova a assinatura de notificações do drive (agendada a cada hora)."""
+    try:
+        drive_id = get_sharepoint_drive_id()
+        if not drive_id:
+            print("Erro: Não foi possível obter o Drive ID para a assinatura de notificações.")
+            return
+        webhook_monitor.garantir_assinatura(get_graph_client(), drive_id, WEBHOOK_URL_PUBLICA,
+                                            obter_client_state(), ler_estado, salvar_estado)
+    except Exception as e:
+        print(f"❌ Erro ao renovar a assinatura de notificações: {e}")
+
+def iniciar_modo_webhook():
+    """Sobe o receptor (com debounce) e, se houver URL pública, a assinatura no Graph."""
+    debouncer = webhook_monitor.Debouncer(lambda: processar_aprovacoes(reexecutar_se_ocupado=True),
+                                          DEBOUNCE_SEGUNDOS, DEBOUNCE_ESPERA_MAXIMA)
+    # O receptor precisa estar no ar antes da assinatura: o Graph valida a URL na criação
+    webhook_monitor.iniciar_receptor(WEBHOOK_PORTA, obter_client_state(), lambda _: debouncer.disparar())
+    if WEBHOOK_URL_PUBLICA:
+        renovar_assinatura_webhook()
+        schedule.every(1).hours.do(renovar_assinatura_webhook)
+    else:
+        print("Aviso: WEBHOOK_URL_PUBLICA não configurada; receptor ativo sem assinatura no Graph.")
+
+def executar_ciclo():
     print(f"[{datetime.now()}] Verificando aprovações...")
     
     drive_id = get_sharepoint_drive_id()
@@ -167,85 +579,110 @@ def processar_aprovacoes():
         return
 
     status_file_path = f'{SHAREPOINT_BASE_PATH}/Status_PSG.xlsx'
+
+    # Consulta só os metadados: se o cTag não mudou desde o último ciclo
+    # concluído sem falhas, não há nada novo para baixar nem processar.
+    metadados = get_sharepoint_item_metadata(drive_id, status_file_path)
+    if not metadados:
+        print("Aviso: Arquivo Status_PSG.xlsx não encontrado ou vazio.")
+        return
+
+    versao_atual = {
+        'eTag': metadados.get('eTag'),
+        'cTag': metadados.get('cTag'),
+        'lastModifiedDateTime': metadados.get('lastModifiedDateTime')
+    }
+    agora = datetime.now()
+    falhas_anteriores = ler_estado(CHAVE_FALHAS_LINHAS) or {}
+    tentativas_vencidas = any(_tentativa_liberada(falha, agora) for falha in falhas_anteriores.values())
+    if versao_atual == ler_estado(CHAVE_ESTADO_PLANILHA) and not tentativas_vencidas:
+        print("Status_PSG.xlsx sem alterações desde o último ciclo.")
+        return
+
     file_content = get_sharepoint_file_content(drive_id, status_file_path)
     
     if not file_content:
         print("Aviso: Arquivo Status_PSG.xlsx não encontrado ou vazio.")
         return
 
+    # Separa as linhas pelo status antes de tocar no SharePoint:
+    # linhas ainda aguardando a governança não geram nenhuma chamada.
+    linhas = []
+    ignoradas = 0
     try:
-        status_data = pd.read_excel(io.BytesIO(file_content))
+        for index, nome, status in planilha_status.ler_linhas(file_content):
+            if status in STATUS_ACIONAVEIS and nome:
+                linhas.append((index, nome, status))
+            else:
+                ignoradas += 1
     except Exception as e:
         print(f"❌ Erro ao ler o arquivo Excel: {e}")
         return
 
-    linhas_para_remover = []  # vamos marcar os índices a remover
-
-    for index, row in status_data.iterrows():
-        nome_documento_sem_extensao = row['Nome']
-        nome_documento_completo = f"{nome_documento_sem_extensao}.docx"
-        status = row['Status']
-
-        pending_file_path = f'{SHAREPOINT_BASE_PATH}/{PASTA_PENDENTES}/{nome_documento_completo}'
-        file_to_upload_content = get_sharepoint_file_content(drive_id, pending_file_path)
-
-        if not file_to_upload_content:
-            print(f"Aviso: Arquivo '{nome_documento_completo}' não encontrado na pasta '{PASTA_PENDENTES}'.")
-            continue
-
-        if status == 'Aprovado':
-            print(f"Documento '{nome_documento_completo}' Aprovado. Processando...")
-
-            pasta_destino = get_pasta_destino_from_filename(nome_documento_sem_extensao)
-            if not pasta_destino:
-                print(f"❌ Erro: Não foi possível encontrar a pasta destino para '{nome_documento_sem_extensao}'.")
-                continue
-
-            if upload_sharepoint_file(drive_id, nome_documento_completo, file_to_upload_content, pasta_destino):
-                print(f"✅ Documento '{nome_documento_completo}' movido para a pasta '{pasta_destino}'.")
-
-                # Remover versão antiga
-                prefix = '-'.join(nome_documento_completo.split('-')[:-1])
-                latest_approved_file = find_latest_approved_version(drive_id, prefix, pasta_destino)
-                if latest_approved_file and latest_approved_file['name'] != nome_documento_completo:
-                    old_item_id = latest_approved_file['id']
-                    if delete_sharepoint_item(drive_id, old_item_id):
-                        print(f"✅ Versão antiga '{latest_approved_file['name']}' removida.")
-
-                # Remover da pasta Pendente
-                item_id_to_delete = get_sharepoint_item_id(drive_id, pending_file_path)
-                if item_id_to_delete and delete_sharepoint_item(drive_id, item_id_to_delete):
-                    print(f"✅ Documento original removido da pasta '{PASTA_PENDENTES}'.")
+    # Linhas que falharam há pouco esperam a vez delas
+    presentes = {_chave_linha(nome, status) for _, nome, status in linhas}
+    aguardando = 0
+    liberadas = []
+    for linha in linhas:
+        if _tentativa_liberada(falhas_anteriores.get(_chave_linha(linha[1], linha[2])), agora):
+            liberadas.append(linha)
+        else:
+            aguardando += 1
+    linhas = liberadas
+    tentadas = [_chave_linha(nome, status) for _, nome, status in linhas]
+    total_acionaveis = len(linhas)
 
+    linhas_para_remover = []  # vamos marcar os índices a remover
+    falhas = 0
+
+    # O índice de versões só é consultado para aprovados; sincroniza uma vez por ciclo
+    if USAR_INDICE_VERSOES and any(status == 'Aprovado' for _, _, status in linhas):
+        if not sincronizar_indice_versoes(drive_id):
+            print("❌ Índice de versões desatualizado. Aprovados ficam para o próximo ciclo.")
+            linhas = [linha for linha in linhas if linha[2] != 'Aprovado']
+            falhas += total_acionaveis - len(linhas)
+
+    if MODO_EXECUCAO == 'lote' and MODO_TRANSFERENCIA == 'mover':
+        linhas_para_remover, falhas_linhas = processar_linhas_em_lote(drive_id, linhas)
+        falhas += falhas_linhas
+    elif MODO_EXECUCAO == 'concorrente':
+        linhas_para_remover, falhas_linhas = processar_linhas_concorrente(drive_id, linhas)
+        falhas += falhas_linhas
+    else:
+        for index, nome, status in linhas:
+            if processar_linha(drive_id, nome, status):
                 # Marcar para remover do Excel
                 linhas_para_remover.append(index)
             else:
-                print(f"❌ Erro ao mover o documento '{nome_documento_completo}'.")
-
-        elif status == 'Reprovado':
-            print(f"Documento '{nome_documento_completo}' Reprovado. Processando...")
+                falhas += 1
 
-            if upload_sharepoint_file(drive_id, nome_documento_completo, file_to_upload_content, PASTA_REPROVADOS):
-                print(f"✅ Documento '{nome_documento_completo}' movido para a pasta '{PASTA_REPROVADOS}'.")
+    print(f"📊 Ciclo concluído: {ignoradas} ignorada(s), {len(linhas_para_remover)} processada(s), "
+          f"{falhas} com falha, {aguardando} aguardando nova tentativa.")
 
-                # Remover da pasta Pendente
-                item_id_to_delete = get_sharepoint_item_id(drive_id, pending_file_path)
-                if item_id_to_delete and delete_sharepoint_item(drive_id, item_id_to_delete):
-                    print(f"✅ Documento original removido da pasta '{PASTA_PENDENTES}'.")
-
-                # Marcar para remover do Excel
-                linhas_para_remover.append(index)
-            else:
-                print(f"❌ Erro ao mover o documento '{nome_documento_completo}'.")
+    # Falhas não impedem memorizar a versão: as linhas com falha voltam pelo registro de
+    # tentativas (com espera crescente), não pelo download da planilha a cada ciclo.
+    # Se a planilha for reescrita abaixo, o novo cTag é lido uma vez no próximo ciclo.
+    valores_linhas = {index: (nome, status) for index, nome, status in linhas}
+    processadas = {_chave_linha(*valores_linhas[index]) for index in linhas_para_remover}
+    salvar_estado(CHAVE_FALHAS_LINHAS, atualizar_falhas_linhas(falhas_anteriores, tentadas, processadas, presentes, agora))
+    if not linhas_para_remover:
+        salvar_estado(CHAVE_ESTADO_PLANILHA, versao_atual)
 
     # 🔄 Atualizar o Status_PSG.xlsx removendo as linhas processadas
     if linhas_para_remover:
-        status_data = status_data.drop(linhas_para_remover)
-        output = io.BytesIO()
-        status_data.to_excel(output, index=False)
-        output.seek(0)
+        # Preferência: excluir só essas linhas da tabela, no próprio SharePoint
+        removidas = remover_linhas_tabela(drive_id, metadados['id'],
+                                          [valores_linhas[index] for index in linhas_para_remover])
+        if removidas is not None:
+            if removidas:
+                print(f"📄 {len(linhas_para_remover)} linha(s) processada(s) removida(s) da tabela do Status_PSG.xlsx.")
+            else:
+                print(f"❌ Erro ao remover linhas processadas do Status_PSG.xlsx.")
+            return
 
-        if upload_sharepoint_file(drive_id, "Status_PSG.xlsx", output.read(), ""):
+        # Planilha sem tabela: reescreve o arquivo inteiro
+        novo_conteudo = planilha_status.remover_linhas(file_content, linhas_para_remover)
+        if upload_sharepoint_file(drive_id, "Status_PSG.xlsx", novo_conteudo, ""):
             print(f"📄 Arquivo Status_PSG.xlsx atualizado com sucesso (linhas processadas removidas).")
         else:
             print(f"❌ Erro ao atualizar Status_PSG.xlsx no SharePoint.")
@@ -255,8 +692,14 @@ if __name__ == "__main__":
     if not all([SHAREPOINT_CLIENT_ID, SHAREPOINT_CLIENT_SECRET, SHAREPOINT_TENANT_ID]):
         print("❌ Por favor, preencha as credenciais do SharePoint no script.")
     else:
-        schedule.every(1).minutes.do(processar_aprovacoes)
-        print("🚀 Agendador iniciado. Verificando aprovações a cada 1 minuto...")
+        criar_banco_de_dados(DATABASE)
+        if MODO_DISPARO == 'webhook':
+            iniciar_modo_webhook()
+            schedule.every(INTERVALO_POLLING_SEGURANCA).minutes.do(processar_aprovacoes)
+            print(f"🚀 Monitor por notificações iniciado (verificação de segurança a cada {INTERVALO_POLLING_SEGURANCA} minutos)...")
+        else:
+            schedule.every(1).minutes.do(processar_aprovacoes)
+            print("🚀 Agendador iniciado. Verificando aprovações a cada 1 minuto...")
 
         while True:
             schedule.run_pending()
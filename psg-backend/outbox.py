@@ -0,0 +1,132 @@
+"""
+Outbox de tarefas pós-geração (upload para o SharePoint, e-mails).
+
+As rotas gravam a tarefa na tabela 'outbox' na mesma transação do documento e
+respondem na hora; um worker em segundo plano entrega as tarefas com novas
+tentativas. A coluna 'chave' é única, então enfileirar a mesma tarefa duas vezes
+não gera entregas duplicadas.
+
+O worker roda junto com o app (python app.py) ou, quando o app é servido por um
+servidor WSGI (gunicorn, waitress), em um processo próprio: python worker_outbox.py
+"""
+import json
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+MAX_TENTATIVAS = 8
+# Tarefas presas em 'processando' (ex.: processo encerrado no meio) voltam para a fila depois disso
+TEMPO_MAXIMO_PROCESSANDO = timedelta(minutes=10)
+
+_acordar_worker = threading.Event()
+
+
+def _agora():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def enfileirar(conn, tipo, payload, chave):
+    """
+    Registra uma tarefa na outbox (dentro da transação de quem chamou, se houver).
+    Retorna True se a tarefa foi criada, False se a chave já existia.
+    """
+    cursor = conn.execute("""
+        INSERT OR IGNORE INTO outbox (tipo, payload_json, chave, status, tentativas, proxima_tentativa, criado_em)
+        VALUES (?, ?, ?, 'pendente', 0, ?, ?)
+    """, (tipo, json.dumps(payload), chave, _agora(), _agora()))
+    return cursor.rowcount == 1
+
+
+def atualizar_payload(conn, chave, payload):
+    """Regrava o payload de uma tarefa (ex.: para guardar o progresso parcial antes de uma nova tentativa)."""
+    conn.execute("UPDATE outbox SET payload_json = ? WHERE chave = ?", (json.dumps(payload), chave))
+
+
+def notificar():
+    """Acorda o worker para processar imediatamente o que acabou de ser enfileirado."""
+    _acordar_worker.set()
+
+
+def _backoff(tentativas):
+    return timedelta(seconds=min(30 * 2 ** (tentativas - 1), 3600))
+
+
+def _reservar(conn, limite):
+    """Reserva até 'limite' tarefas vencidas; a reserva é atômica, então vários workers podem rodar."""
+    limite_processando = (datetime.now() - TEMPO_MAXIMO_PROCESSANDO).isoformat(timespec='seconds')
+    conn.execute("""
+        UPDATE outbox SET status = 'pendente'
+        WHERE status = 'processando' AND reservado_em < ?
+    """, (limite_processando,))
+
+    candidatas = conn.execute("""
+        SELECT id, tipo, payload_json, chave, tentativas FROM outbox
+        WHERE status = 'pendente' AND proxima_tentativa <= ?
+        ORDER BY id LIMIT ?
+    """, (_agora(), limite)).fetchall()
+
+    reservadas = []
+    for tarefa in candidatas:
+        cursor = conn.execute("""
+            UPDATE outbox SET status = 'processando', tentativas = tentativas + 1, reservado_em = ?
+            WHERE id = ? AND status = 'pendente'
+        """, (_agora(), tarefa['id']))
+        if cursor.rowcount == 1:
+            reservadas.append(tarefa)
+    return reservadas
+
+
+def processar_pendentes(abrir_conexao, handlers, limite=10):
+    """
+    Executa as tarefas vencidas. handlers: dict tipo -> função(conn, payload, chave) que
+    retorna True em caso de sucesso. Retorna a quantidade de tarefas processadas.
+    abrir_conexao deve devolver uma conexão em autocommit (ex.: banco.get_connection),
+    reaproveitada pela thread do worker.
+    """
+    conn = abrir_conexao()
+    tarefas = _reservar(conn, limite)
+    for tarefa in tarefas:
+        tentativas = tarefa['tentativas'] + 1
+        try:
+            handler = handlers[tarefa['tipo']]
+            sucesso = handler(conn, json.loads(tarefa['payload_json']), tarefa['chave'])
+            erro = None if sucesso else 'Handler retornou falha.'
+        except Exception as e:
+            traceback.print_exc()
+            sucesso, erro = False, str(e)
+
+        if sucesso:
+            conn.execute("""
+                UPDATE outbox SET status = 'concluido', concluido_em = ?, ultimo_erro = NULL WHERE id = ?
+            """, (_agora(), tarefa['id']))
+        elif tentativas >= MAX_TENTATIVAS:
+            print(f"❌ Tarefa '{tarefa['chave']}' falhou {tentativas} vezes e foi abandonada: {erro}")
+            conn.execute("UPDATE outbox SET status = 'falhou', ultimo_erro = ? WHERE id = ?",
+                         (erro, tarefa['id']))
+        else:
+            proxima = (datetime.now() + _backoff(tentativas)).isoformat(timespec='seconds')
+            conn.execute("""
+                UPDATE outbox SET status = 'pendente', proxima_tentativa = ?, ultimo_erro = ? WHERE id = ?
+            """, (proxima, erro, tarefa['id']))
+    return len(tarefas)
+
+
+def executar_worker(abrir_conexao, handlers, intervalo=5):
+    """Laço do worker: processa as tarefas vencidas e, sem nada a fazer, espera 'intervalo' segundos."""
+    while True:
+        try:
+            processadas = processar_pendentes(abrir_conexao, handlers)
+        except Exception as e:
+            print(f"❌ Erro no worker da outbox: {e}")
+            processadas = 0
+        if not processadas:
+            _acordar_worker.wait(intervalo)
+            _acordar_worker.clear()
+
+
+def iniciar_worker(abrir_conexao, handlers, intervalo=5):
+    """Inicia o worker da outbox em uma thread daemon do próprio processo."""
+    thread = threading.Thread(target=executar_worker, args=(abrir_conexao, handlers, intervalo),
+                              name='outbox-worker', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,68 @@
+"""
+Leitura e escrita leves do Status_PSG.xlsx com openpyxl (sem pandas).
+
+A leitura usa o modo read_only, que percorre as linhas sob demanda em vez de montar a
+planilha inteira em memória; a escrita usa o modo write_only. Os índices das linhas
+começam em 0 na primeira linha depois do cabeçalho.
+"""
+import io
+from openpyxl import Workbook, load_workbook
+
+COLUNA_NOME = 'Nome'
+COLUNA_STATUS = 'Status'
+
+
+def _texto(valor):
+    return str(valor).strip() if valor is not None else None
+
+
+def _abrir(conteudo):
+    return load_workbook(io.BytesIO(conteudo), read_only=True, data_only=True)
+
+
+def ler_linhas(conteudo):
+    """
+    Gera (indice_linha, nome, status) para cada linha preenchida da primeira aba.
+    Levanta ValueError se as colunas 'Nome' e 'Status' não estiverem no cabeçalho.
+    """
+    workbook = _abrir(conteudo)
+    try:
+        linhas = workbook.worksheets[0].iter_rows(values_only=True)
+        cabecalho = [_texto(valor) for valor in next(linhas, ())]
+        if COLUNA_NOME not in cabecalho or COLUNA_STATUS not in cabecalho:
+            raise ValueError(f"Cabeçalho sem as colunas '{COLUNA_NOME}' e '{COLUNA_STATUS}'.")
+        col_nome, col_status = cabecalho.index(COLUNA_NOME), cabecalho.index(COLUNA_STATUS)
+
+        for indice, valores in enumerate(linhas):
+            nome = _texto(valores[col_nome]) if col_nome < len(valores) else None
+            status = _texto(valores[col_status]) if col_status < len(valores) else None
+            if nome or status:
+                yield indice, nome, status
+    finally:
+        workbook.close()
+
+
+def remover_linhas(conteudo, indices):
+    """
+    Retorna os bytes de uma nova planilha igual à original (todas as colunas da primeira
+    aba), sem as linhas de dados cujos índices estão em 'indices'.
+    """
+    remover = set(indices)
+    original = _abrir(conteudo)
+    novo = Workbook(write_only=True)
+    try:
+        aba_original = original.worksheets[0]
+        aba_nova = novo.create_sheet(title=aba_original.title)
+        linhas = aba_original.iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if cabecalho is not None:
+            aba_nova.append(cabecalho)
+        for indice, valores in enumerate(linhas):
+            if indice not in remover:
+                aba_nova.append(valores)
+    finally:
+        original.close()
+
+    saida = io.BytesIO()
+    novo.save(saida)
+    return saida.getvalue()
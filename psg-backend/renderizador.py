@@ -0,0 +1,257 @@
+"""
+Motor de renderização dos documentos em processos separados.
+
+python-docx/lxml é trabalho de CPU em Python puro: nas threads do Flask tudo disputa
+o GIL e um PSG grande atrasa as outras requisições. Aqui o app monta uma especificação
+só com dados simples (textos, listas e bytes das imagens) e um pool de processos
+(já aquecidos com o modelo base em cache) devolve os bytes .docx prontos.
+
+Cada processo do pool tem o seu próprio Pipe e atende um documento por vez: quando um
+documento estoura TIMEOUT_RENDERIZACAO, só o processo dele é encerrado e trocado por
+outro, e os demais pedidos seguem sem esperar por ele.
+
+Especificação:
+    {
+        'cabecalho': {'titulo_pasta', 'sigla_pasta', 'tema_sigla', 'numero_documento',
+                      'data_aprovacao', 'imagem_esquerda', 'imagem_direita'},
+        'blocos': [
+            ('secao', titulo, conteudo),
+            ('titulo', texto),
+            ('paragrafo', texto),
+            ('imagem', nome_arquivo, bytes),
+            ('tabela_revisoes', numero_documento, revisoes),
+        ]
+    }
+"""
+import hashlib
+import io
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from docx.shared import Inches
+import modelo_documento
+import anexos_imagem
+
+# --- Configurações do pool ---
+USAR_PROCESSOS = True
+TAMANHO_POOL = max(2, (os.cpu_count() or 2) - 1)
+# Processos são reciclados depois de N documentos (libera a memória acumulada pelo lxml)
+MAX_TAREFAS_POR_PROCESSO = 200
+# Tempo máximo de espera por um documento (fila + renderização), em segundos;
+# o processo que passar disso é encerrado
+TIMEOUT_RENDERIZACAO = 60
+# Documentos aguardando ou em renderização; acima disso o pedido é recusado na hora
+LIMITE_FILA = 4 * TAMANHO_POOL
+LARGURA_IMAGEM_ANEXO = Inches(anexos_imagem.LARGURA_IMPRESSAO_POLEGADAS)
+
+
+class RenderizacaoIndisponivel(Exception):
+    """A fila de renderização está cheia."""
+
+
+_lock = threading.Lock()
+_iniciado = False
+_imagens_modelo = None
+_processos = set()
+_livres = queue.Queue()
+_vagas = threading.BoundedSemaphore(LIMITE_FILA)
+
+
+# --- Lado do processo de renderização ---
+
+def adicionar_secao(doc, titulo_secao, conteudo):
+    """Adiciona uma seção com título e conteúdo ao documento."""
+    doc.add_heading(titulo_secao, level=2)
+    doc.add_paragraph(conteudo if conteudo.strip() else "Não informado.")
+
+
+def adicionar_imagem(doc, nome_arquivo, dados, otimizadas):
+    """otimizadas: sha256 -> bytes já otimizados neste documento (imagens repetidas)."""
+    doc.add_paragraph(f"Arquivo: {nome_arquivo}")
+    try:
+        hash_conteudo = hashlib.sha256(dados).hexdigest()
+        if hash_conteudo not in otimizadas:
+            otimizadas[hash_conteudo] = anexos_imagem.otimizar(dados)
+        doc.add_paragraph().add_run().add_picture(io.BytesIO(otimizadas[hash_conteudo]), width=LARGURA_IMAGEM_ANEXO)
+    except Exception as e:
+        doc.add_paragraph(f"Erro ao inserir imagem {nome_arquivo}: {str(e)}")
+
+
+def adicionar_tabela_revisoes(doc, numero_documento, revisoes):
+    table = doc.add_table(rows=1, cols=4)
+    table.style = "Table Grid"
+    hdr_cells = table.rows[0].cells
+    for i, texto in enumerate(["Revisão", "Data", "Responsável", "Alteração"]):
+        hdr_cells[i].text = texto
+        hdr_cells[i].paragraphs[0].runs[0].font.bold = True
+
+    for revisao in revisoes:
+        row = table.add_row().cells
+        row[0].text = numero_documento
+        row[1].text = revisao.get("data", "")
+        row[2].text = revisao.get("responsavel", "")
+        row[3].text = revisao.get("alteracao", "")
+
+
+def construir_documento(spec):
+    """Renderiza a especificação e retorna os bytes .docx (roda no processo do pool)."""
+    c = spec['cabecalho']
+    doc = modelo_documento.novo_documento(
+        c['titulo_pasta'], c['sigla_pasta'], c['tema_sigla'], c['numero_documento'],
+        c['imagem_esquerda'], c['imagem_direita'], c.get('data_aprovacao')
+    )
+    otimizadas = {}
+    for bloco in spec['blocos']:
+        tipo = bloco[0]
+        if tipo == 'secao':
+            adicionar_secao(doc, bloco[1], bloco[2])
+        elif tipo == 'titulo':
+            doc.add_heading(bloco[1], level=2)
+        elif tipo == 'paragrafo':
+            doc.add_paragraph(bloco[1])
+        elif tipo == 'imagem':
+            adicionar_imagem(doc, bloco[1], bloco[2], otimizadas)
+        elif tipo == 'tabela_revisoes':
+            adicionar_tabela_revisoes(doc, bloco[1], bloco[2])
+        else:
+            raise ValueError(f"Bloco desconhecido na especificação: {tipo}")
+
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def _aquecer(imagem_esquerda, imagem_direita):
+    """Inicializador dos processos: deixa o modelo base pronto antes do primeiro pedido."""
+    try:
+        modelo_documento.obter_modelo(imagem_esquerda, imagem_direita)
+    except Exception as e:
+        print(f"Aviso: não foi possível pré-carregar o modelo no processo de renderização: {e}")
+
+
+def _servir(conexao, imagem_esquerda, imagem_direita):
+    """Laço de um processo do pool: recebe especificações e devolve (sucesso, bytes ou exceção)."""
+    _aquecer(imagem_esquerda, imagem_direita)
+    while True:
+        try:
+            spec = conexao.recv()
+        except EOFError:
+            return
+        if spec is None:
+            return
+        try:
+            conexao.send((True, construir_documento(spec)))
+        except Exception as e:
+            try:
+                conexao.send((False, e))
+            except Exception:
+                conexao.send((False, RuntimeError(str(e))))
+
+
+# --- Lado do app ---
+
+class _Processo:
+    """Um processo de renderização com o seu próprio Pipe, que pode ser encerrado sozinho."""
+
+    def __init__(self):
+        # 'spawn': o app tem threads (Flask, outbox) e fork com threads não é seguro
+        contexto = multiprocessing.get_context('spawn')
+        self.conexao, conexao_filho = contexto.Pipe()
+        self.processo = contexto.Process(target=_servir, args=(conexao_filho, *_imagens_modelo),
+                                         name='renderizador', daemon=True)
+        self.processo.start()
+        conexao_filho.close()
+        self.tarefas = 0
+
+    def encerrar(self):
+        self.processo.kill()
+        self.processo.join()
+        self.conexao.close()
+
+
+def _novo_processo():
+    processo = _Processo()
+    with _lock:
+        _processos.add(processo)
+    return processo
+
+
+def _substituir(processo):
+    """Encerra o processo (travado, reciclado ou morto) e retorna um novo no lugar dele."""
+    with _lock:
+        _processos.discard(processo)
+    processo.encerrar()
+    return _novo_processo()
+
+
+def iniciar(imagem_esquerda, imagem_direita):
+    """Cria o pool (se ainda não existir), com os processos já aquecendo o modelo."""
+    global _iniciado, _imagens_modelo
+    with _lock:
+        if _iniciado or not USAR_PROCESSOS:
+            return
+        _iniciado = True
+        _imagens_modelo = (imagem_esquerda, imagem_direita)
+    for _ in range(TAMANHO_POOL):
+        _livres.put(_novo_processo())
+
+
+def encerrar():
+    global _iniciado
+    with _lock:
+        processos = list(_processos)
+        _processos.clear()
+        _iniciado = False
+    while not _livres.empty():
+        _livres.get_nowait()
+    for processo in processos:
+        processo.encerrar()
+
+
+def renderizar(spec):
+    """
+    Renderiza a especificação no pool e retorna os bytes .docx.
+    Levanta RenderizacaoIndisponivel se a fila estiver cheia e TimeoutError se o
+    documento não ficar pronto em TIMEOUT_RENDERIZACAO segundos.
+    """
+    if not USAR_PROCESSOS:
+        return construir_documento(spec)
+
+    c = spec['cabecalho']
+    iniciar(c['imagem_esquerda'], c['imagem_direita'])
+    if not _vagas.acquire(blocking=False):
+        raise RenderizacaoIndisponivel("Fila de renderização cheia, tente novamente em instantes.")
+    try:
+        limite = time.monotonic() + TIMEOUT_RENDERIZACAO
+        try:
+            processo = _livres.get(timeout=TIMEOUT_RENDERIZACAO)
+        except queue.Empty:
+            raise TimeoutError(f"Documento não renderizado em {TIMEOUT_RENDERIZACAO}s.")
+
+        # O processo sempre volta para a fila: o mesmo, ou um novo se este precisou ser encerrado
+        try:
+            try:
+                processo.conexao.send(spec)
+                pronto = processo.conexao.poll(max(0, limite - time.monotonic()))
+                resposta = processo.conexao.recv() if pronto else None
+            except (EOFError, BrokenPipeError, ConnectionResetError):
+                processo = _substituir(processo)
+                raise RuntimeError("O processo de renderização foi encerrado inesperadamente.")
+            if resposta is None:
+                # Ainda renderizando: encerra só este processo antes de liberar a vaga
+                processo = _substituir(processo)
+                raise TimeoutError(f"Documento não renderizado em {TIMEOUT_RENDERIZACAO}s.")
+            processo.tarefas += 1
+            if processo.tarefas >= MAX_TAREFAS_POR_PROCESSO:
+                processo = _substituir(processo)
+        finally:
+            _livres.put(processo)
+
+        sucesso, resultado = resposta
+        if not sucesso:
+            raise resultado
+        return resultado
+    finally:
+        _vagas.release()
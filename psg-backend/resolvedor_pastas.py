@@ -0,0 +1,88 @@
+"""
+Resolução em memória de token do nome do arquivo (PSG-{token}-...) -> nome da pasta destino.
+
+O esquema de 'pastas' é inspecionado só quando o mapa é (re)construído, e o mapa fica
+em memória até a tabela mudar. Mudanças são detectadas por um contador em
+'versoes_tabelas', mantido por triggers em 'pastas' (cria_banco, migração 007): vale para
+escritas feitas por qualquer processo (ex.: /criar_pasta no app.py).
+Tokens não encontrados ficam em cache negativo por TTL_NEGATIVO segundos.
+"""
+import threading
+import time
+
+# Colunas de código aceitas, em ordem de prioridade (as que não existirem são ignoradas)
+COLUNAS_TOKEN = ('sigla', 'codigo', 'abreviacao', 'codigo_pasta')
+TTL_NEGATIVO = 300
+
+_lock = threading.Lock()
+_cache = {'versao': None, 'por_id': {}, 'por_codigo': [], 'nomes': [], 'resolvidos': {}, 'negativos': {}}
+
+
+def _versao_pastas(conn):
+    row = conn.execute("SELECT versao FROM versoes_tabelas WHERE tabela = 'pastas'").fetchone()
+    return row['versao'] if row else 0
+
+
+def _construir(conn, versao):
+    colunas_existentes = {c['name'] for c in conn.execute("PRAGMA table_info(pastas)").fetchall()}
+    colunas = [col for col in COLUNAS_TOKEN if col in colunas_existentes]
+
+    rows = conn.execute(f"SELECT {', '.join(['id', 'nome'] + colunas)} FROM pastas ORDER BY id").fetchall()
+    # Um mapa por coluna, na ordem de prioridade; dentro da coluna vale a pasta de menor id
+    por_codigo = []
+    for col in colunas:
+        mapa = {}
+        for row in rows:
+            if row[col] is not None:
+                mapa.setdefault(str(row[col]).casefold(), row['nome'])
+        por_codigo.append(mapa)
+    _cache.update({
+        'versao': versao,
+        'por_id': {row['id']: row['nome'] for row in rows},
+        'por_codigo': por_codigo,
+        'nomes': [row['nome'] for row in rows],
+        'resolvidos': {},
+        'negativos': {},
+    })
+
+
+def _resolver_no_mapa(token):
+    try:
+        nome = _cache['por_id'].get(int(token))
+        if nome:
+            return nome
+    except ValueError:
+        pass
+
+    chave = token.casefold()
+    for mapa in _cache['por_codigo']:
+        if chave in mapa:
+            return mapa[chave]
+
+    # Último recurso: nome que contenha o token (antes era um LIKE '%token%' na tabela toda)
+    for nome in _cache['nomes']:
+        if chave in nome.casefold():
+            return nome
+    return None
+
+
+def resolver(conn, token):
+    """Retorna o nome da pasta para o token, ou None. Só consulta o banco para checar a versão."""
+    versao = _versao_pastas(conn)
+    with _lock:
+        if _cache['versao'] != versao:
+            _construir(conn, versao)
+
+        if token in _cache['resolvidos']:
+            return _cache['resolvidos'][token]
+        expira = _cache['negativos'].get(token)
+        if expira and expira > time.monotonic():
+            return None
+
+        nome = _resolver_no_mapa(token)
+        if nome:
+            _cache['resolvidos'][token] = nome
+        else:
+            _cache['negativos'][token] = time.monotonic() + TTL_NEGATIVO
+        return nome
+
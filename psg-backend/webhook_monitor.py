@@ -0,0 +1,236 @@
+"""
+Disparo do monitor por notificações de alteração do Microsoft Graph (webhooks).
+
+- receptor HTTP mínimo (http.server, sem Flask): responde o handshake de validação
+  (ecoa o validationToken) e aceita só notificações com o clientState esperado;
+- Debouncer: rajadas de notificações viram uma única execução do ciclo;
+- assinatura no drive (o Graph só aceita assinaturas de driveItem na raiz do drive),
+  criada e renovada automaticamente, com os dados guardados em monitor_estado;
+- notificador falso para testes locais: python webhook_monitor.py --simular
+"""
+import argparse
+import hmac
+import json
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CAMINHO_WEBHOOK = '/notificacoes'
+TAMANHO_MAXIMO_NOTIFICACAO = 1024 * 1024
+
+CHAVE_ASSINATURA = 'webhook_assinatura'
+# Assinaturas de driveItem valem no máximo ~29 dias; renovamos bem antes de vencer
+DURACAO_ASSINATURA = timedelta(days=2)
+MARGEM_RENOVACAO = timedelta(hours=12)
+
+
+class Debouncer:
+    """
+    Agrupa disparos próximos: a ação roda 'espera' segundos depois do último disparo,
+    mas nunca mais que 'espera_maxima' segundos depois do primeiro da rajada.
+    """
+
+    def __init__(self, acao, espera, espera_maxima):
+        self.acao = acao
+        self.espera = espera
+        self.espera_maxima = espera_maxima
+        self._lock = threading.Lock()
+        self._timer = None
+        self._primeiro = None
+        self._disparos = 0
+
+    def disparar(self):
+        with self._lock:
+            agora = time.monotonic()
+            if self._primeiro is None:
+                self._primeiro = agora
+            self._disparos += 1
+            atraso = min(self.espera, max(0, self._primeiro + self.espera_maxima - agora))
+            if self._timer:
+                self._timer.cancel()
+            self._timer = threading.Timer(atraso, self._executar)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _executar(self):
+        with self._lock:
+            disparos = self._disparos
+            self._timer = None
+            self._primeiro = None
+            self._disparos = 0
+        print(f"[{datetime.now()}] 🔔 {disparos} notificação(ões) agrupada(s) em uma execução.")
+        try:
+            self.acao()
+        except Exception as e:
+            print(f"❌ Erro na execução disparada por notificação: {e}")
+
+
+# --- Receptor ---
+
+def iniciar_receptor(porta, client_state, ao_notificar, host='0.0.0.0'):
+    """
+    Sobe o receptor em uma thread daemon e retorna o servidor.
+    ao_notificar(notificacoes) recebe a lista das notificações com clientState válido.
+    """
+    class ReceptorNotificacoes(BaseHTTPRequestHandler):
+        def do_POST(self):
+            url = urllib.parse.urlparse(self.path)
+            if url.path != CAMINHO_WEBHOOK:
+                self._responder(404)
+                return
+
+            # Handshake: o Graph valida a URL ao criar a assinatura e espera o token de volta em até 10 s
+            token = urllib.parse.parse_qs(url.query).get('validationToken')
+            if token:
+                self._responder(200, token[0], 'text/plain')
+                return
+
+            tamanho = int(self.headers.get('Content-Length') or 0)
+            if tamanho > TAMANHO_MAXIMO_NOTIFICACAO:
+                self._responder(413)
+                return
+            try:
+                notificacoes = json.loads(self.rfile.read(tamanho) or b'{}').get('value', [])
+            except (ValueError, AttributeError):
+                self._responder(400)
+                return
+
+            validas = [n for n in notificacoes
+                       if hmac.compare_digest(str(n.get('clientState', '')), client_state)]
+            if len(validas) < len(notificacoes):
+                print(f"Aviso: {len(notificacoes) - len(validas)} notificação(ões) com clientState inválido ignorada(s).")
+
+            # Responde logo (o Graph espera 2xx rápido); o processamento fica com o debouncer
+            self._responder(202)
+            if validas:
+                ao_notificar(validas)
+
+        def _responder(self, status, corpo='', tipo='text/plain'):
+            dados = corpo.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', tipo)
+            self.send_header('Content-Length', str(len(dados)))
+            self.end_headers()
+            self.wfile.write(dados)
+
+        def log_message(self, formato, *args):
+            pass
+
+    servidor = ThreadingHTTPServer((host, porta), ReceptorNotificacoes)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name='receptor-webhook', daemon=True).start()
+    print(f"📡 Receptor de notificações ouvindo em {host}:{porta}{CAMINHO_WEBHOOK}")
+    return servidor
+
+
+# --- Assinatura no Graph ---
+
+def _formatar_data(data):
+    return data.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.0000000Z')
+
+
+def _ler_data(texto):
+    """Datas do Graph vêm em UTC ('2026-01-01T12:00:00.0000000Z'); os segundos bastam."""
+    return datetime.strptime(texto[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+
+
+def garantir_assinatura(graph, drive_id, notification_url, client_state, ler_estado, salvar_estado):
+    """
+    Cria a assinatura de alterações do drive ou renova a atual se faltar menos de
+    MARGEM_RENOVACAO para vencer. Se a renovação falhar (ex.: assinatura removida
+    pelo Graph), cria outra. Retorna True se ficou uma assinatura válida.
+    """
+    recurso = f'/drives/{drive_id}/root'
+    agora = datetime.now(timezone.utc)
+    nova_expiracao = _formatar_data(agora + DURACAO_ASSINATURA)
+
+    atual = ler_estado(CHAVE_ASSINATURA)
+    if atual and atual.get('recurso') == recurso and atual.get('notification_url') == notification_url:
+        if _ler_data(atual['expiracao']) - agora > MARGEM_RENOVACAO:
+            return True
+        response = graph.patch(f"/subscriptions/{atual['id']}", json={'expirationDateTime': nova_expiracao})
+        if response.status_code == 200:
+            salvar_estado(CHAVE_ASSINATURA, {**atual, 'expiracao': response.json().get('expirationDateTime', nova_expiracao)})
+            print(f"🔁 Assinatura de notificações renovada até {nova_expiracao}.")
+            return True
+        print(f"Aviso: não foi possível renovar a assinatura (status {response.status_code}). Criando outra.")
+
+    response = graph.post('/subscriptions', json={
+        'changeType': 'updated',
+        'notificationUrl': notification_url,
+        'resource': recurso,
+        'expirationDateTime': nova_expiracao,
+        'clientState': client_state,
+    })
+    if response.status_code != 201:
+        print(f"❌ Erro ao criar a assinatura de notificações. Status: {response.status_code} {response.text}")
+        return False
+    assinatura = response.json()
+    salvar_estado(CHAVE_ASSINATURA, {
+        'id': assinatura['id'],
+        'expiracao': assinatura.get('expirationDateTime', nova_expiracao),
+        'recurso': recurso,
+        'notification_url': notification_url,
+    })
+    print(f"✅ Assinatura de notificações criada ({assinatura['id']}).")
+    return True
+
+
+# --- Notificador falso (testes locais) ---
+
+def _enviar(url, corpo=None):
+    dados = json.dumps(corpo).encode('utf-8') if corpo is not None else b''
+    requisicao = urllib.request.Request(url, data=dados, method='POST',
+                                        headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(requisicao, timeout=10) as resposta:
+            return resposta.status, resposta.read().decode('utf-8')
+    except urllib.error.HTTPError as e:
+        return e.code, ''
+
+
+def simular_notificacoes(url, client_state, quantidade=5):
+    """Faz o papel do Graph contra um receptor: handshake, uma rajada válida e uma notificação forjada."""
+    status, corpo = _enviar(f"{url}?validationToken={urllib.parse.quote('token de teste')}")
+    print(f"Handshake: {status} (eco: {corpo!r})")
+
+    notificacao = {
+        'subscriptionId': 'assinatura-simulada',
+        'changeType': 'updated',
+        'resource': 'drives/simulado/root',
+        'subscriptionExpirationDateTime': _formatar_data(datetime.now(timezone.utc) + DURACAO_ASSINATURA),
+        'clientState': client_state,
+    }
+    for i in range(quantidade):
+        status, _ = _enviar(url, {'value': [notificacao]})
+        print(f"Notificação {i + 1}/{quantidade}: {status}")
+
+    status, _ = _enviar(url, {'value': [{**notificacao, 'clientState': 'forjado'}]})
+    print(f"Notificação com clientState inválido: {status}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Notificador falso do Graph para testar o receptor do monitor.')
+    parser.add_argument('--simular', action='store_true', help='envia notificações simuladas')
+    parser.add_argument('--url', help='receptor já em execução (padrão: sobe um receptor local de teste)')
+    parser.add_argument('--client-state', default='client-state-de-teste')
+    parser.add_argument('--porta', type=int, default=8765)
+    parser.add_argument('--quantidade', type=int, default=5)
+    args = parser.parse_args()
+
+    if not args.simular:
+        parser.print_help()
+    elif args.url:
+        simular_notificacoes(args.url, args.client_state, args.quantidade)
+    else:
+        execucoes = threading.Event()
+        debouncer = Debouncer(lambda: (print("✅ Ciclo do monitor seria executado agora."), execucoes.set()),
+                              espera=1, espera_maxima=5)
+        servidor = iniciar_receptor(args.porta, args.client_state, lambda _: debouncer.disparar(), host='127.0.0.1')
+        simular_notificacoes(f'http://127.0.0.1:{args.porta}{CAMINHO_WEBHOOK}', args.client_state, args.quantidade)
+        execucoes.wait(10)
+        servidor.shutdown()
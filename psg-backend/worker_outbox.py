@@ -0,0 +1,21 @@
+"""
+Worker da outbox em um processo próprio.
+
+Quando o app é servido por um servidor WSGI (gunicorn, waitress), o bloco __main__ do
+app.py não executa e nenhum worker sobe junto com as requisições: sem este processo,
+os uploads para o SharePoint e os e-mails ficariam na fila para sempre.
+
+Uso: python worker_outbox.py (um processo basta; vários também funcionam, pois a
+reserva das tarefas é atômica).
+"""
+import outbox
+from cria_banco import criar_banco_de_dados
+import app
+
+# Sem o aviso em memória do app (outro processo), a fila é consultada a cada INTERVALO segundos
+INTERVALO = 5
+
+if __name__ == '__main__':
+    criar_banco_de_dados(app.DATABASE)
+    print(f"🚀 Worker da outbox iniciado (verificando a fila a cada {INTERVALO}s)...")
+    outbox.executar_worker(app.get_db_connection, app.TAREFAS_OUTBOX, INTERVALO)